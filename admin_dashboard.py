@@ -0,0 +1,97 @@
+import hmac
+import os
+from datetime import datetime, timedelta, timezone
+import streamlit as st
+from pymongo import MongoClient
+import metrics
+from llm_cache import LLMResponseCache
+
+# Operator view of a running study wave: streamlit run admin_dashboard.py
+# Reads the snapshots every app process exports to the metrics collection, so it covers all replicas.
+st.set_page_config(page_title="InclusiArt AI metrics", layout="wide")
+
+# Processes that have not reported within this long are considered gone
+LIVE_PROCESS_SECONDS = 120
+
+@st.cache_resource
+def get_metrics_collection():
+    client = MongoClient(st.secrets["mongo"]["uri"])
+    return client['inclusiai_db']['metrics']
+
+def check_password():
+    if st.session_state.get('admin_authenticated'):
+        return True
+    password = st.text_input("Admin password", type="password")
+    if password:
+        if hmac.compare_digest(password.encode(), st.secrets["admin_password"].encode()):
+            st.session_state['admin_authenticated'] = True
+            st.rerun()
+        st.error("Incorrect password.")
+    return False
+
+def format_seconds(value):
+    return None if value is None else round(value, 3)
+
+@st.fragment(run_every=10)
+def show_metrics():
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=LIVE_PROCESS_SECONDS)
+    snapshots = list(get_metrics_collection().find({"updated_at": {"$gte": cutoff}}))
+    if not snapshots:
+        st.info("No app process has reported metrics in the last two minutes.")
+        return
+    merged = metrics.merge_snapshots(snapshots)
+    # Spans only: events such as sessions started or cache hits are in recent_events
+    recent = merged['recent']
+    recent_events = merged['recent_events']
+    window_minutes = metrics.RECENT_WINDOW_SECONDS / 60
+    recent_count = sum(entry['count'] for entry in recent.values())
+    recent_errors = sum(entry['errors'] for entry in recent.values())
+
+    columns = st.columns(4)
+    columns[0].metric("Live app processes", len(snapshots))
+    columns[1].metric("Sessions started / min", f"{recent_events.get('sessions_started', 0) / window_minutes:.1f}")
+    columns[2].metric("Sessions completed / min", f"{recent_events.get('sessions_completed', 0) / window_minutes:.1f}")
+    columns[3].metric("Error rate (last 5 min)", f"{recent_errors / recent_count:.1%}" if recent_count else "n/a")
+
+    st.subheader("Slowest steps")
+    rows = [{
+        'operation': h['operation'],
+        'step': h['step'],
+        'calls': h['count'],
+        'errors': h['errors'],
+        'error rate': round(h['errors'] / h['count'], 3) if h['count'] else 0,
+        'mean (s)': format_seconds(h['sum'] / h['count']) if h['count'] else None,
+        'p50 (s)': format_seconds(metrics.percentile(h['buckets'], 0.50)),
+        'p95 (s)': format_seconds(metrics.percentile(h['buckets'], 0.95)),
+        'p99 (s)': format_seconds(metrics.percentile(h['buckets'], 0.99)),
+    } for h in merged['histograms']]
+    st.dataframe(sorted(rows, key=lambda row: row['p95 (s)'] or 0, reverse=True), use_container_width=True)
+
+    st.subheader("Throughput over the last 5 minutes")
+    st.dataframe(sorted(
+        [{'operation': name, 'per minute': round(entry['count'] / window_minutes, 2), 'errors': entry['errors']}
+         for name, entry in recent.items()],
+        key=lambda row: row['per minute'], reverse=True
+    ), use_container_width=True)
+
+    st.subheader("Events over the last 5 minutes")
+    st.dataframe(sorted(
+        [{'event': name, 'per minute': round(count / window_minutes, 2), 'total': merged['counters'].get(name, 0)}
+         for name, count in recent_events.items()],
+        key=lambda row: row['per minute'], reverse=True
+    ), use_container_width=True)
+    if merged['totals']:
+        st.json(merged['totals'])
+
+    st.subheader("Slowest recent calls")
+    st.dataframe([{**span, 'at': datetime.fromtimestamp(span['at'], timezone.utc)} for span in merged['slowest']],
+                 use_container_width=True)
+
+    cache_path = st.secrets.get("llm_cache", {}).get("path", "llm_cache.db")
+    if os.path.exists(cache_path):
+        st.subheader("LLM response cache")
+        st.json(LLMResponseCache(cache_path).stats())
+
+st.title("InclusiArt AI metrics")
+if check_password():
+    show_metrics()
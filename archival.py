@@ -0,0 +1,94 @@
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+import streamlit as st
+import metrics
+
+ARCHIVE_WORKERS = 4
+ARCHIVE_RETRIES = 3
+ARCHIVE_BACKOFF_SECONDS = 2
+# (connect, read) timeouts of the image download
+DOWNLOAD_TIMEOUT = (10, 30)
+# Pillow format, mimetype and file extension of each supported storage format
+IMAGE_FORMATS = {
+    "jpeg": ("JPEG", "image/jpeg", ".jpg"),
+    "webp": ("WEBP", "image/webp", ".webp"),
+}
+
+# Images are stored as JPEG or WebP; set format and quality in the images section of secrets.toml,
+# e.g. [images] format = "webp", quality = 80
+def image_settings():
+    config = st.secrets.get("images", {})
+    return IMAGE_FORMATS[config.get("format", "jpeg").lower()], int(config.get("quality", 85))
+
+# Re-encode a generated PNG (a binary file object) in the storage format; returns an in-memory file
+def encode_image(source):
+    from PIL import Image
+    (pil_format, _, _), quality = image_settings()
+    buffer = io.BytesIO()
+    with metrics.span("image_encode"), Image.open(source) as image:
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        image.save(buffer, format=pil_format, quality=quality)
+    buffer.seek(0)
+    return buffer
+
+# Stream a generated image from its URL straight into the encoder
+def download_image(image_url):
+    import requests
+    with metrics.span("image_download"):
+        with requests.get(image_url, stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+            response.raise_for_status()
+            response.raw.decode_content = True
+            return encode_image(response.raw)
+
+# One executor per server process, shared by all participant sessions
+@st.cache_resource
+def get_archive_executor():
+    return ThreadPoolExecutor(max_workers=ARCHIVE_WORKERS, thread_name_prefix="drive-archive")
+
+# Store a generated image in the configured image store (Google Drive by default), retrying with exponential
+# backoff. The image is either the URL of the generated image, which is downloaded and encoded here, or the
+# already encoded bytes; the file extension is added to filename according to the storage format.
+# (requests and the storage clients are imported on the archive worker instead of on the first page load)
+def archive_image(image, filename, retries=ARCHIVE_RETRIES):
+    from image_storage import get_image_store
+    (_, mimetype, extension), _ = image_settings()
+    for attempt in range(retries):
+        try:
+            image_file = download_image(image) if isinstance(image, str) else io.BytesIO(image)
+            link = get_image_store().put(image_file, filename + extension, mimetype)
+            metrics.add("image_stored_bytes", image_file.getbuffer().nbytes)
+            return link
+        except Exception:
+            if attempt == retries - 1:
+                raise
+            time.sleep(ARCHIVE_BACKOFF_SECONDS * 2 ** attempt)
+
+def archive_image_timed(image, filename):
+    with metrics.span("image_archive"):
+        return archive_image(image, filename)
+
+# Queue the archival so the participant can see the image while it uploads
+# (spans are tagged with the session and step that queued it)
+def submit_archive(image, filename):
+    return get_archive_executor().submit(metrics.with_current_tags(archive_image_timed), image, filename)
+
+# Return the Drive link of a finished upload, or None while it is still running or if it failed
+def archived_link(future):
+    if future is None or not future.done() or future.exception() is not None:
+        return None
+    return future.result()
+
+# Wait for a pending upload; if the background job gave up, make one last attempt in the foreground
+def resolve_archive(future, image, filename, timeout=60):
+    try:
+        return future.result(timeout=timeout)
+    except TimeoutError:
+        return None
+    except Exception:
+        try:
+            return archive_image(image, filename, retries=1)
+        except Exception as e:
+            st.error(f"Error archiving the image: {e}")
+            return None
@@ -0,0 +1,209 @@
+import argparse
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import prompt_analysis
+
+# Run the bias analysis and inclusive rewrite of the study over a file of prompts, without the app:
+#   python batch_analysis.py prompts.jsonl results.jsonl [--mode sequential] [--workers 32]
+#   python batch_analysis.py prompts.jsonl results.jsonl --batch-api
+# Each input line is a JSON object with the prompt (and optionally an id, otherwise the line number is used).
+# Results are appended to the output file as they complete, one JSON line per prompt, and prompts already in
+# the output are skipped, so an interrupted run resumes where it stopped. The worker pool sends its requests
+# through the app's rate-limit-aware scheduler and response cache (openai_limits and llm_cache settings in
+# .streamlit/secrets.toml); --batch-api submits them as OpenAI Batch API jobs instead, at batch pricing.
+
+# Requests per Batch API job (the API accepts up to 50,000)
+BATCH_API_MAX_REQUESTS = 50000
+BATCH_API_DONE_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+def read_prompts(path, prompt_field, id_field):
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            yield {'id': str(item.get(id_field) or f"line-{number}"), 'prompt': item[prompt_field]}
+
+# Ids already in the output file; a line cut short by an interrupted run is dropped so appending continues cleanly
+def load_checkpoint(path):
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, "rb+") as f:
+        valid_size = 0
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            done.add(json.loads(line)['id'])
+            valid_size += len(line)
+        f.truncate(valid_size)
+    return done
+
+class ResultWriter:
+    def __init__(self, path):
+        self.file = open(path, "a")
+        self.written = 0
+
+    def write(self, result):
+        self.file.write(json.dumps(result) + "\n")
+        self.file.flush()
+        self.written += 1
+
+    def close(self):
+        self.file.close()
+
+def analyze(item, mode):
+    result = prompt_analysis.analyze_prompt(item['prompt'], mode)
+    return {**item, 'mode': mode, 'analysis_fallback': result.get('analysis_fallback', False),
+            'bias_example': result.get('bias_example', ''), 'inclusive_suggestion': result.get('inclusive_suggestion', '')}
+
+# Keep at most two prompts per worker in flight, so memory stays flat however long the input is;
+# throughput is then set by the scheduler's rate limits rather than by waiting on each round-trip
+def run_worker_pool(items, mode, workers, writer):
+    failed = 0
+    in_flight = set()
+
+    def collect(done):
+        nonlocal failed
+        for future in done:
+            try:
+                writer.write(future.result())
+            except Exception as e:
+                failed += 1
+                print(f"Failed: {e}", file=sys.stderr)
+
+    with ThreadPoolExecutor(workers, thread_name_prefix="batch-analysis") as executor:
+        for item in items:
+            if len(in_flight) >= 2 * workers:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+            in_flight.add(executor.submit(analyze, item, mode))
+        collect(wait(in_flight).done)
+    return failed
+
+# Submit chat completion requests as Batch API jobs; returns the job ids
+def submit_batches(requests):
+    client = prompt_analysis.get_openai_client()
+    batch_ids = []
+    for start in range(0, len(requests), BATCH_API_MAX_REQUESTS):
+        lines = [json.dumps({'custom_id': custom_id, 'method': "POST", 'url': "/v1/chat/completions", 'body': body})
+                 for custom_id, body in requests[start:start + BATCH_API_MAX_REQUESTS]]
+        input_file = client.files.create(file=("requests.jsonl", io.BytesIO("\n".join(lines).encode())), purpose="batch")
+        batch = client.batches.create(input_file_id=input_file.id, endpoint="/v1/chat/completions", completion_window="24h")
+        batch_ids.append(batch.id)
+    return batch_ids
+
+# Wait for the jobs to finish; returns the message content of each successful request by custom_id
+def collect_batches(batch_ids, poll_interval):
+    client = prompt_analysis.get_openai_client()
+    contents = {}
+    for batch_id in batch_ids:
+        while True:
+            try:
+                batch = client.batches.retrieve(batch_id)
+            except Exception as e:
+                print(f"Could not check batch {batch_id}: {e}", file=sys.stderr)
+            else:
+                if batch.status in BATCH_API_DONE_STATUSES:
+                    break
+                print(f"Batch {batch_id}: {batch.status}", file=sys.stderr)
+            time.sleep(poll_interval)
+        if not batch.output_file_id:
+            print(f"Batch {batch_id} ended as {batch.status} without results", file=sys.stderr)
+            continue
+        for line in client.files.content(batch.output_file_id).text.splitlines():
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            response = entry.get('response') or {}
+            if response.get('status_code') == 200:
+                contents[entry['custom_id']] = response['body']['choices'][0]['message']['content']
+            else:
+                print(f"Failed: {entry['custom_id']}: {entry.get('error') or response.get('body')}", file=sys.stderr)
+    return contents
+
+# Submitted job ids are kept in a state file next to the output, so a resumed run waits for them instead
+# of submitting the prompts again. The sequential mode runs two phases, bias analysis then rewrite,
+# and keeps the bias analyses of the first phase in the state file.
+def run_batch_api(items, mode, writer, state_path, poll_interval):
+    state = {'mode': mode}
+    if os.path.exists(state_path):
+        with open(state_path) as f:
+            state = json.load(f)
+        if state['mode'] != mode:
+            raise SystemExit(f"{state_path} belongs to a {state['mode']} run; resume it with --mode {state['mode']}")
+    items = {item['id']: item for item in items}
+    pending = len(items)
+
+    def save_state(**changes):
+        state.update(changes)
+        with open(f"{state_path}.tmp", "w") as f:
+            json.dump(state, f)
+        os.replace(f"{state_path}.tmp", state_path)
+
+    def run_phase(phase, build_request):
+        if state.get('phase') != phase:
+            requests = [(item_id, build_request(item)) for item_id, item in items.items()]
+            save_state(phase=phase, batch_ids=submit_batches(requests) if requests else [])
+        return collect_batches(state['batch_ids'], poll_interval)
+
+    if mode == "sequential":
+        if state.get('phase') != "rewrite":
+            bias_examples = run_phase("bias", lambda item: prompt_analysis.bias_example_request(item['prompt']))
+            save_state(bias_examples=bias_examples)
+        items = {item_id: item for item_id, item in items.items() if state['bias_examples'].get(item_id)}
+        suggestions = run_phase("rewrite", lambda item: prompt_analysis.inclusive_prompt_request(item['prompt'], state['bias_examples'][item['id']]))
+        results = {item_id: {'bias_example': state['bias_examples'][item_id], 'inclusive_suggestion': suggestion}
+                   for item_id, suggestion in suggestions.items()}
+    else:
+        results = {}
+        for item_id, content in run_phase("combined", lambda item: prompt_analysis.bias_and_suggestion_request(item['prompt'])).items():
+            try:
+                results[item_id] = json.loads(content)
+            except json.JSONDecodeError:
+                print(f"Failed: {item_id}: unparseable response", file=sys.stderr)
+
+    for item_id, result in results.items():
+        if item_id in items:
+            writer.write({**items[item_id], 'mode': mode, 'bias_example': result.get('bias_example', ''),
+                          'inclusive_suggestion': result.get('inclusive_suggestion', '')})
+    os.remove(state_path)
+    return pending - len(results)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the InclusiArt AI bias analysis and rewrite over a prompt file")
+    parser.add_argument("input", help="JSONL file of prompts")
+    parser.add_argument("output", help="JSONL file the results are appended to")
+    parser.add_argument("--prompt-field", default="prompt")
+    parser.add_argument("--id-field", default="id")
+    parser.add_argument("--mode", choices=("combined", "sequential"), default=prompt_analysis.ANALYSIS_MODE)
+    parser.add_argument("--workers", type=int, default=32, help="concurrent prompts in worker pool mode")
+    parser.add_argument("--batch-api", action="store_true", help="submit the prompts as OpenAI Batch API jobs")
+    parser.add_argument("--poll-interval", type=float, default=60, help="seconds between Batch API status checks")
+    parser.add_argument("--no-cache", action="store_true", help="do not use the shared LLM response cache")
+    args = parser.parse_args()
+    if args.no_cache:
+        prompt_analysis.LLM_CACHE_ENABLED = False
+
+    done = load_checkpoint(args.output)
+    items = (item for item in read_prompts(args.input, args.prompt_field, args.id_field) if item['id'] not in done)
+    writer = ResultWriter(args.output)
+    start = time.perf_counter()
+    try:
+        if args.batch_api:
+            failed = run_batch_api(items, args.mode, writer, f"{args.output}.batch.json", args.poll_interval)
+        else:
+            failed = run_worker_pool(items, args.mode, args.workers, writer)
+    finally:
+        writer.close()
+    elapsed = time.perf_counter() - start
+    print(f"{writer.written} prompts analysed in {elapsed:.1f}s ({writer.written / elapsed * 60 if elapsed else 0:.0f}/min), "
+          f"{len(done)} already done, {failed} failed")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
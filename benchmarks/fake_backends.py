@@ -0,0 +1,90 @@
+import random
+import threading
+import time
+import uuid
+
+# In-process stand-ins for Google Drive and MongoDB so the app can run without credentials
+
+class FakeRequest:
+    def __init__(self, result, latency):
+        self.result = result
+        self.latency = latency
+
+    def execute(self, http=None):
+        time.sleep(random.uniform(*self.latency))
+        return self.result
+
+class FakeBatch:
+    def __init__(self, latency, callback=None):
+        self.latency = latency
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request):
+        self.requests.append(request)
+
+    def execute(self, http=None):
+        time.sleep(random.uniform(*self.latency))
+        for i, request in enumerate(self.requests):
+            if self.callback:
+                self.callback(str(i), request.result, None)
+
+# Mimics the parts of the Drive v3 client used by google_drive_utils and records what was stored
+class FakeDriveService:
+    def __init__(self, upload_latency=(0.2, 0.6), permission_latency=(0.05, 0.15)):
+        self.upload_latency = upload_latency
+        self.permission_latency = permission_latency
+        self.lock = threading.Lock()
+        self.stored_files = {}
+        self.uploaded_bytes = 0
+        self.permission_requests = 0
+
+    def files_create(self, body, media_body=None, fields=None):
+        file_id = uuid.uuid4().hex
+        size = media_body.size() if media_body is not None else 0
+        if media_body is not None:
+            media_body.getbytes(0, size)
+        with self.lock:
+            self.stored_files[file_id] = {'name': body['name'], 'size': size, 'parents': body.get('parents')}
+            self.uploaded_bytes += size
+        return FakeRequest({'id': file_id, 'webViewLink': f"https://drive.example/file/{file_id}/view"}, self.upload_latency)
+
+    def permissions_create(self, fileId, body, fields=None):
+        with self.lock:
+            self.permission_requests += 1
+        return FakeRequest({'id': uuid.uuid4().hex}, self.permission_latency)
+
+    def files(self):
+        return FakeResource(create=self.files_create)
+
+    def permissions(self):
+        return FakeResource(create=self.permissions_create)
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatch(self.permission_latency, callback)
+
+class FakeResource:
+    def __init__(self, **methods):
+        self.__dict__.update(methods)
+
+# Route google_drive_utils to a FakeDriveService
+def install_fake_drive(service=None):
+    import google_drive_utils
+    service = service or FakeDriveService()
+    google_drive_utils.get_drive_service = lambda: service
+    google_drive_utils.get_drive_credentials = lambda: None
+    google_drive_utils.get_authorized_http = lambda: None
+    return service
+
+# Replace pymongo.MongoClient with mongomock's in-memory client (pip install mongomock),
+# unless the benchmark is pointed at a real local mongod with --mongo-uri
+def install_fake_mongo():
+    import mongomock
+    import mongomock.collection
+    import pymongo
+    # Newer pymongo versions pass a sort argument to bulk updates that mongomock does not accept yet
+    add_update = mongomock.collection.BulkOperationBuilder.add_update
+    mongomock.collection.BulkOperationBuilder.add_update = (
+        lambda self, selector, doc, multi=False, upsert=False, sort=None, **kwargs: add_update(self, selector, doc, multi, upsert, **kwargs))
+    pymongo.MongoClient = mongomock.MongoClient
+    return mongomock
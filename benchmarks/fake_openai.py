@@ -0,0 +1,218 @@
+import argparse
+import base64
+import email.parser
+import json
+import random
+import struct
+import threading
+import time
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-in for the OpenAI chat completions and images endpoints used by inclusiart.py, and the
+# files and batches endpoints used by batch_analysis.py --batch-api (batches complete immediately).
+# Latencies are drawn uniformly from the configured (min, max) ranges in seconds, and error_rate
+# injects 429 (with Retry-After) and 500 responses.
+
+# Build a valid RGB PNG of random noise so downloads and transcoding handle realistic bytes
+def make_png(size=256):
+    raw = b"".join(b"\x00" + random.randbytes(size * 3) for _ in range(size))
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+    header = struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(raw, 1)) + chunk(b"IEND", b"")
+
+class FakeOpenAIConfig:
+    def __init__(self, chat_latency=(0.3, 0.8), image_latency=(2.0, 4.0), download_latency=(0.05, 0.2),
+                 error_rate=0.0, truncate_rate=0.0, image_size=512, stream_chunks=12):
+        self.chat_latency = chat_latency
+        self.image_latency = image_latency
+        self.download_latency = download_latency
+        self.error_rate = error_rate
+        # Share of streamed replies cut off halfway with finish_reason "length", as at max_tokens
+        self.truncate_rate = truncate_rate
+        self.image_size = image_size
+        self.stream_chunks = stream_chunks
+        self.requests = 0
+        self.errors = 0
+        self.files = {}
+        self.batches = {}
+        self.lock = threading.Lock()
+
+def chat_content(request):
+    system_prompt = request['messages'][0]['content']
+    if request.get('response_format', {}).get('type') == 'json_schema':
+        return json.dumps({
+            "bias_example": "The description may lead to a stereotypically young, male and able-bodied portrayal.",
+            "inclusive_suggestion": "A wise adventurer of any gender, age and background, shown with their own distinct features.",
+        })
+    if "professions" in system_prompt:
+        return "\n".join(f"profession {i}" for i in range(20))
+    if "rewriting" in system_prompt:
+        return "A wise adventurer of any gender, age and background, shown with their own distinct features."
+    return "The description may lead to a stereotypically young, male and able-bodied portrayal."
+
+def make_handler(config, png_bytes):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def send_json(self, status, body, headers=None):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.send_header("x-ratelimit-remaining-requests", "1000")
+            self.send_header("x-ratelimit-reset-requests", "1s")
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def inject_error(self):
+            with config.lock:
+                config.requests += 1
+                if random.random() >= config.error_rate:
+                    return False
+                config.errors += 1
+            if random.random() < 0.5:
+                self.send_json(429, {"error": {"message": "Rate limit reached", "type": "requests"}}, {"retry-after": "1"})
+            else:
+                self.send_json(500, {"error": {"message": "Injected server error", "type": "server_error"}})
+            return True
+
+        def do_GET(self):
+            if "/batches/" in self.path:
+                batch = config.batches.get(self.path.rsplit("/", 1)[1])
+                self.send_json(200, batch) if batch else self.send_json(404, {"error": {"message": "No such batch"}})
+                return
+            if "/files/" in self.path and self.path.endswith("/content"):
+                content = config.files.get(self.path.split("/")[-2], b"")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+                return
+            if not self.path.startswith("/images/"):
+                self.send_json(404, {"error": {"message": "Not found"}})
+                return
+            time.sleep(random.uniform(*config.download_latency))
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png")
+            self.send_header("Content-Length", str(len(png_bytes)))
+            self.end_headers()
+            self.wfile.write(png_bytes)
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if self.path.endswith("/files"):
+                self.upload_file(body)
+                return
+            request = json.loads(body or b"{}")
+            if self.path.endswith("/batches"):
+                self.run_batch(request)
+            elif self.path.endswith("/chat/completions"):
+                time.sleep(random.uniform(*config.chat_latency))
+                if not self.inject_error():
+                    self.chat_completion(request)
+            elif self.path.endswith("/images/generations"):
+                time.sleep(random.uniform(*config.image_latency))
+                if not self.inject_error():
+                    self.image_generation(request)
+            else:
+                self.send_json(404, {"error": {"message": "Not found"}})
+
+        def chat_completion(self, request):
+            content = chat_content(request)
+            completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+            if not request.get("stream"):
+                self.send_json(200, {
+                    "id": completion_id, "object": "chat.completion", "created": int(time.time()), "model": request['model'],
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": 50, "completion_tokens": 50, "total_tokens": 100},
+                })
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            finish_reason = "stop"
+            if random.random() < config.truncate_rate:
+                content, finish_reason = content[:len(content) // 2], "length"
+            step = max(1, len(content) // config.stream_chunks)
+            for start in range(0, len(content), step):
+                chunk = {
+                    "id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": request['model'],
+                    "choices": [{"index": 0, "delta": {"content": content[start:start + step]}, "finish_reason": None}],
+                }
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.wfile.flush()
+                time.sleep(0.01)
+            chunk = {
+                "id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": request['model'],
+                "choices": [{"index": 0, "delta": {}, "finish_reason": finish_reason}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.close_connection = True
+
+        def upload_file(self, body):
+            message = email.parser.BytesParser().parsebytes(
+                f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + body)
+            content = next(part.get_payload(decode=True) for part in message.get_payload() if part.get_filename())
+            file_id = f"file-{uuid.uuid4().hex}"
+            config.files[file_id] = content
+            self.send_json(200, {"id": file_id, "object": "file", "bytes": len(content), "created_at": int(time.time()),
+                                 "filename": "requests.jsonl", "purpose": "batch", "status": "processed"})
+
+        def run_batch(self, request):
+            output = []
+            for line in config.files[request['input_file_id']].decode().splitlines():
+                entry = json.loads(line)
+                content = chat_content(entry['body'])
+                output.append(json.dumps({"id": f"batch_req_{uuid.uuid4().hex}", "custom_id": entry['custom_id'], "error": None,
+                                          "response": {"status_code": 200, "body": {
+                                              "id": f"chatcmpl-{uuid.uuid4().hex}", "object": "chat.completion",
+                                              "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}]}}}))
+            output_file_id = f"file-{uuid.uuid4().hex}"
+            config.files[output_file_id] = "\n".join(output).encode()
+            batch = {"id": f"batch_{uuid.uuid4().hex}", "object": "batch", "endpoint": request['endpoint'], "input_file_id": request['input_file_id'],
+                     "completion_window": request['completion_window'], "status": "completed", "output_file_id": output_file_id,
+                     "created_at": int(time.time()), "request_counts": {"total": len(output), "completed": len(output), "failed": 0}}
+            config.batches[batch['id']] = batch
+            self.send_json(200, batch)
+
+        def image_generation(self, request):
+            if request.get("response_format") == "b64_json":
+                image = {"b64_json": base64.b64encode(png_bytes).decode(), "revised_prompt": request['prompt']}
+            else:
+                host = self.headers.get("Host")
+                image = {"url": f"http://{host}/images/{uuid.uuid4().hex}.png", "revised_prompt": request['prompt']}
+            self.send_json(200, {"created": int(time.time()), "data": [image]})
+
+    return Handler
+
+# Start the stub on a background thread; returns (server, base_url to use as openai_base_url)
+def start_fake_openai(config=None, host="127.0.0.1", port=0):
+    config = config or FakeOpenAIConfig()
+    server = ThreadingHTTPServer((host, port), make_handler(config, make_png(config.image_size)))
+    server.daemon_threads = True
+    server.config = config
+    threading.Thread(target=server.serve_forever, daemon=True, name="fake-openai").start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a local stand-in for the OpenAI API")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--truncate-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    server, base_url = start_fake_openai(FakeOpenAIConfig(error_rate=args.error_rate, truncate_rate=args.truncate_rate), port=args.port)
+    print(f"Fake OpenAI API listening on {base_url} (set openai_base_url to this in secrets.toml)")
+    threading.Event().wait()
@@ -0,0 +1,130 @@
+import argparse
+import json
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# Offline load test: drives simulated participants through the full study flow of inclusiart.py with
+# Streamlit's AppTest, against a local OpenAI stub, a fake Drive service and an in-memory MongoDB.
+#   python benchmarks/load_test.py --participants 50 --concurrency 10
+# AppTest runs one script at a time per process, so each concurrent participant runs in its own worker
+# process (like separate app replicas sharing the OpenAI stub). Use --mongo-uri mongodb://localhost:27017
+# to benchmark against a real local mongod, shared by all workers, instead of the per-process mongomock.
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_openai import FakeOpenAIConfig, start_fake_openai
+from simulated_participant import init_worker, run_task
+import metrics
+
+# Minimal secrets.toml writer for top-level values and one level of tables
+def write_secrets(path, secrets):
+    scalars = [f"{key} = {json.dumps(value)}" for key, value in secrets.items() if not isinstance(value, dict)]
+    tables = [f"\n[{key}]\n" + "\n".join(f"{k} = {json.dumps(v)}" for k, v in value.items())
+              for key, value in secrets.items() if isinstance(value, dict)]
+    with open(path, "w") as f:
+        f.write("\n".join(scalars + tables) + "\n")
+
+def summarize(values):
+    if len(values) < 2:
+        return {'n': len(values), 'mean': values[0] if values else None}
+    quantiles = statistics.quantiles(values, n=100, method='inclusive')
+    return {'n': len(values), 'mean': statistics.mean(values), 'p50': quantiles[49], 'p95': quantiles[94], 'p99': quantiles[98]}
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test of the InclusiArt AI study flow")
+    parser.add_argument("--participants", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=5)
+    parser.add_argument("--chat-latency", type=float, nargs=2, default=(0.3, 0.8), metavar=("MIN", "MAX"))
+    parser.add_argument("--image-latency", type=float, nargs=2, default=(2.0, 4.0), metavar=("MIN", "MAX"))
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of OpenAI requests answered with 429/500")
+    parser.add_argument("--truncate-rate", type=float, default=0.0, help="share of streamed chat replies cut off at max_tokens")
+    parser.add_argument("--analysis-mode", choices=("combined", "sequential"), default="combined")
+    parser.add_argument("--image-response-format", choices=("url", "b64_json"), default="url")
+    parser.add_argument("--image-format", choices=("jpeg", "webp"), default="jpeg", help="format images are stored in")
+    parser.add_argument("--image-storage", choices=("drive", "local"), default="drive", help="fake Drive or a local store in the work directory")
+    parser.add_argument("--mongo-uri", help="real MongoDB to use instead of the in-memory stand-in")
+    parser.add_argument("--timeout", type=float, default=120, help="seconds allowed per step")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    server, base_url = start_fake_openai(FakeOpenAIConfig(chat_latency=tuple(args.chat_latency), image_latency=tuple(args.image_latency),
+                                                          error_rate=args.error_rate, truncate_rate=args.truncate_rate))
+    work_dir = tempfile.mkdtemp(prefix="inclusiart-bench-")
+    secrets = {
+        "OPENAI_API_KEY": "sk-benchmark",
+        "openai_base_url": base_url,
+        "mongo": {"uri": args.mongo_uri or "mongodb://localhost:27017"},
+        "google_service_account": {},
+        "analysis_mode": args.analysis_mode,
+        "llm_cache": {"path": os.path.join(work_dir, "llm_cache.db")},
+        "progress_writes": {"flush_interval": 0.5},
+        "images": {"response_format": args.image_response_format, "format": args.image_format},
+        "image_storage": {"backend": args.image_storage, **({"path": os.path.join(work_dir, "image_store")} if args.image_storage == "local" else {})},
+    }
+    os.makedirs(os.path.join(work_dir, ".streamlit"))
+    write_secrets(os.path.join(work_dir, ".streamlit", "secrets.toml"), secrets)
+
+    # Warm up each worker (imports, first script compilation) before the clock starts
+    with ProcessPoolExecutor(args.concurrency, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=init_worker, initargs=(work_dir, not args.mongo_uri)) as executor:
+        list(executor.map(time.sleep, [0.5] * args.concurrency))
+        start = time.perf_counter()
+        tasks = list(executor.map(run_task, range(args.participants), [args.timeout] * args.participants))
+        elapsed = time.perf_counter() - start
+
+    results = [task for task in tasks if task['error'] is None]
+    failures = [f"participant {task['index']}: {task['error']}" for task in tasks if task['error'] is not None]
+    steps = {}
+    for task in results:
+        for name, seconds in task['timings'].items():
+            steps.setdefault(name, []).append(seconds)
+    # Counters are cumulative per worker, so keep the last report of each
+    latest = {task['pid']: task for task in sorted(tasks, key=lambda task: task['metrics']['updated_at'])}
+    snapshot = metrics.merge_snapshots([task['metrics'] for task in latest.values()])
+    report = {
+        'participants': args.participants,
+        'concurrency': args.concurrency,
+        'completed': len(results),
+        'failed': len(failures),
+        'elapsed_seconds': elapsed,
+        'sessions_per_minute': len(results) / elapsed * 60,
+        'memory_per_session_kib': statistics.mean(task['memory'] for task in results) / 1024 if results else None,
+        'peak_memory_mib': max(task['peak_memory'] for task in tasks) / 1024 / 1024,
+        'steps': {name: summarize(values) for name, values in sorted(steps.items())},
+        'operations': {f"{h['operation']} [{h['step']}]": {
+            'count': h['count'], 'errors': h['errors'],
+            'p50': metrics.percentile(h['buckets'], 0.5), 'p95': metrics.percentile(h['buckets'], 0.95)}
+            for h in snapshot['histograms']},
+        'analysis_fallbacks': sum(task['analysis_fallback'] for task in results),
+        'openai_requests': server.config.requests,
+        'openai_injected_errors': server.config.errors,
+        'drive_uploads': sum(task['drive']['uploads'] for task in latest.values()),
+        'drive_uploaded_bytes': sum(task['drive']['bytes'] for task in latest.values()),
+        'failures': failures[:10],
+    }
+
+    print(f"{report['completed']}/{args.participants} sessions in {elapsed:.1f}s "
+          f"({report['sessions_per_minute']:.1f} sessions/min, {report['memory_per_session_kib'] or 0:.0f} KiB/session, "
+          f"peak {report['peak_memory_mib']:.0f} MiB per worker)")
+    if report['analysis_fallbacks']:
+        print(f"{report['analysis_fallbacks']} sessions fell back to the two-call analysis")
+    print(f"\n{'step':<28}{'mean':>8}{'p50':>8}{'p95':>8}{'p99':>8}")
+    for name, summary in report['steps'].items():
+        print(f"{name:<28}" + "".join(f"{summary.get(key) or 0:>8.2f}" for key in ('mean', 'p50', 'p95', 'p99')))
+    print(f"\n{'operation [step]':<56}{'count':>7}{'errors':>7}{'p50':>8}{'p95':>8}")
+    for name, summary in sorted(report['operations'].items(), key=lambda item: -(item[1]['p95'] or 0)):
+        print(f"{name:<56}{summary['count']:>7}{summary['errors']:>7}{summary['p50'] or 0:>8.3f}{summary['p95'] or 0:>8.3f}")
+    for failure in failures[:10]:
+        print(f"FAILED {failure}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2, default=str)
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
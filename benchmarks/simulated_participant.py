@@ -0,0 +1,79 @@
+import os
+import sys
+import time
+import tracemalloc
+
+# One simulated participant, run by the load test's worker processes (kept out of load_test.py because
+# AppTest replaces the __main__ module while the app script runs)
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(REPO_ROOT, "inclusiart.py")
+sys.path.insert(0, REPO_ROOT)
+
+from streamlit.testing.v1 import AppTest
+from fake_backends import install_fake_drive, install_fake_mongo
+import metrics
+
+PROMPTS = [
+    "A brave knight who protects the kingdom",
+    "A wise old wizard with a long beard",
+    "A fierce warrior princess",
+    "A mysterious elf archer from the forest",
+    "A cunning thief in the city of thieves",
+]
+
+def find_widget(widgets, label):
+    return next(widget for widget in widgets if widget.label.startswith(label))
+
+def check(at):
+    if at.exception:
+        raise RuntimeError(f"{at.exception[0].message} {''.join(at.exception[0].stack_trace[-3:])}")
+    return at
+
+# One participant, one step at a time; returns the seconds each step took (including its rerun)
+def run_participant(index, timeout):
+    at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+    timings = {}
+
+    def step(name, action):
+        start = time.perf_counter()
+        check(action())
+        timings[name] = time.perf_counter() - start
+
+    step("01_load_page", lambda: at.run())
+    step("02_prolific_id", lambda: at.text_input(key="prolific_id_input").input(f"BENCH{index:06d}").run())
+    step("05_bias_analysis", lambda: at.text_input(key="initial_prompt_input").input(PROMPTS[index % len(PROMPTS)]).run())
+    step("07_confirm_final_prompt", lambda: find_widget(at.button, "Confirm Final Prompt").click().run())
+    step("08_rating", lambda: at.radio(key="rating_radio").set_value(5).run())
+    step("09_additional_feedback", lambda: at.text_input(key="additional_feedback_input").input("Looks inclusive.").run())
+    step("10_test_prompt", lambda: at.text_input(key="test_prompt_input").input("A person of any gender and age at work").run())
+    step("11_additional_rating", lambda: at.radio(key="additional_rating_radio").set_value(6).run())
+    step("13_save", lambda: find_widget(at.button, "Save and Receive Code").click().run())
+    if not any("Data saved successfully" in success.value for success in at.success):
+        raise RuntimeError("The final save did not succeed")
+    return timings, at
+
+_drive = None
+
+def init_worker(work_dir, fake_mongo):
+    global _drive
+    _drive = install_fake_drive()
+    if fake_mongo:
+        install_fake_mongo()
+    os.chdir(work_dir)
+    tracemalloc.start()
+
+# Run one participant in a worker process; memory is what the finished session still holds
+def run_task(index, timeout):
+    before = tracemalloc.get_traced_memory()[0]
+    result = {'index': index, 'pid': os.getpid(), 'timings': {}, 'error': None}
+    try:
+        result['timings'], at = run_participant(index, timeout)
+        result['analysis_fallback'] = at.session_state['analysis_fallback']
+        result['memory'] = tracemalloc.get_traced_memory()[0] - before
+    except Exception as e:
+        result['error'] = repr(e)
+    result['peak_memory'] = tracemalloc.get_traced_memory()[1]
+    result['metrics'] = metrics.registry.snapshot()
+    result['drive'] = {'uploads': len(_drive.stored_files), 'bytes': _drive.uploaded_bytes}
+    return result
@@ -0,0 +1,104 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Cold-start benchmark: how long a fresh app process takes to draw the first page, and which of the heavy
+# client libraries it had to import for it.
+#   python benchmarks/startup_time.py --runs 5
+# Each run is a new interpreter started with python -X importtime, so the import breakdown of the first
+# render is included. Warm-up is disabled and the service endpoints are unreachable: the first page must
+# not need any of them.
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(REPO_ROOT, "inclusiart.py")
+# Libraries only needed from step 2 (MongoDB), step 5 (OpenAI) and step 7 (image archival) on
+HEAVY_MODULES = ("openai", "pymongo", "requests", "googleapiclient", "google.oauth2")
+
+# Runs in the measured interpreter: time the first render of the app with AppTest
+def run_child():
+    start = time.perf_counter()
+    from streamlit.testing.v1 import AppTest
+    streamlit_loaded = time.perf_counter()
+    at = AppTest.from_file(APP_PATH, default_timeout=60).run()
+    first_render = time.perf_counter()
+    print(json.dumps({
+        'streamlit_import_seconds': streamlit_loaded - start,
+        'first_render_seconds': first_render - streamlit_loaded,
+        'loaded': [name for name in HEAVY_MODULES if name in sys.modules],
+        'exception': at.exception[0].message if at.exception else None,
+    }))
+
+# Cumulative import time in seconds of each heavy module, from the -X importtime lines on stderr
+def parse_importtime(stderr):
+    seconds = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        name = name.strip()
+        if name in HEAVY_MODULES and name not in seconds and cumulative.strip().isdigit():
+            seconds[name] = int(cumulative) / 1e6
+    return seconds
+
+def run_once(work_dir):
+    process = subprocess.run([sys.executable, "-X", "importtime", os.path.abspath(__file__), "--child"],
+                             cwd=work_dir, capture_output=True, text=True, timeout=300)
+    if process.returncode:
+        raise RuntimeError(process.stderr[-2000:])
+    result = json.loads(process.stdout.strip().splitlines()[-1])
+    result['import_seconds'] = parse_importtime(process.stderr)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the cold start of the InclusiArt AI app process")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+    if args.child:
+        run_child()
+        return 0
+
+    # Imported here so the measured child interpreter does not load the load test's modules
+    sys.path.insert(0, os.path.join(REPO_ROOT, "benchmarks"))
+    from load_test import write_secrets
+
+    work_dir = tempfile.mkdtemp(prefix="inclusiart-startup-")
+    os.makedirs(os.path.join(work_dir, ".streamlit"))
+    write_secrets(os.path.join(work_dir, ".streamlit", "secrets.toml"), {
+        "OPENAI_API_KEY": "sk-benchmark",
+        "openai_base_url": "http://127.0.0.1:9/v1",
+        "mongo": {"uri": "mongodb://127.0.0.1:9/?serverSelectionTimeoutMS=1000"},
+        "google_service_account": {},
+        "warm_up": False,
+    })
+    runs = [run_once(work_dir) for _ in range(args.runs)]
+    report = {
+        'runs': args.runs,
+        'streamlit_import_seconds': statistics.median(run['streamlit_import_seconds'] for run in runs),
+        'first_render_seconds': statistics.median(run['first_render_seconds'] for run in runs),
+        'loaded_before_first_render': sorted({name for run in runs for name in run['loaded']}),
+        'import_seconds': {name: statistics.median(run['import_seconds'].get(name, 0) for run in runs) for name in HEAVY_MODULES},
+        'exceptions': [run['exception'] for run in runs if run['exception']],
+    }
+
+    print(f"first render {report['first_render_seconds']:.3f}s after importing streamlit "
+          f"({report['streamlit_import_seconds']:.3f}s), median of {args.runs} cold processes")
+    print(f"\n{'module':<20}{'loaded':>8}{'import s':>10}")
+    for name in HEAVY_MODULES:
+        loaded = "yes" if name in report['loaded_before_first_render'] else "no"
+        print(f"{name:<20}{loaded:>8}{report['import_seconds'][name]:>10.3f}")
+    for exception in report['exceptions'][:3]:
+        print(f"FAILED {exception}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 1 if report['exceptions'] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,322 @@
+import argparse
+import csv
+import glob
+import json
+import os
+import re
+import shutil
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import streamlit as st
+
+# Export the study records for analysis:
+#   python export_data.py records.parquet --summary summary.json --images images/
+# Records are streamed from MongoDB in batches with only the exported fields, and written to Parquet
+# (needs pyarrow: pip install pyarrow) or CSV as they arrive; with --images, each batch's images are
+# downloaded before the next batch is read. With --summary, the per-condition summaries are computed by
+# aggregation pipelines on the server (MongoDB 4.4 or later). The MongoDB URI and Drive credentials are
+# read from .streamlit/secrets.toml, as in the app.
+
+DATABASE = 'inclusiai_db'
+COLLECTION = 'inclusive_data'
+BATCH_SIZE = 5000
+
+# Exported fields and their Parquet types (everything else is a string)
+EXPORT_FIELDS = [
+    'prolific_id', 'analysis_mode', 'analysis_fallback', 'user_prompt', 'bias_example', 'inclusive_suggestion', 'final_prompt',
+    'image_url', 'rating', 'speculative_outcome', 'additional_feedback', 'random_profession',
+    'random_profession_category', 'test_prompt', 'test_image_url', 'images_archived', 'additional_rating', 'completed',
+]
+INTEGER_FIELDS = {'rating', 'additional_rating'}
+BOOLEAN_FIELDS = {'analysis_fallback', 'images_archived', 'completed'}
+# Image links of a record and the suffix of their downloaded file names
+IMAGE_FIELDS = {'image_url': 'prompted', 'test_image_url': 'test'}
+IMAGE_EXTENSIONS = {'image/jpeg': ".jpg", 'image/png': ".png", 'image/webp': ".webp"}
+
+def get_collection(mongo_uri):
+    from pymongo import MongoClient
+    return MongoClient(mongo_uri)[DATABASE][COLLECTION]
+
+# Completed records only, unless in-progress ones are asked for (records saved before progress tracking
+# have no completed field and count as completed). Sessions whose combined analysis fell back to the
+# two-call path can be left out, so the combined condition only holds sessions that got it.
+def record_filter(include_incomplete, exclude_fallback=False):
+    match = {} if include_incomplete else {"completed": {"$ne": False}}
+    if exclude_fallback:
+        match["analysis_fallback"] = {"$ne": True}
+    return match
+
+def stream_records(collection, match, batch_size=BATCH_SIZE):
+    projection = {field: 1 for field in EXPORT_FIELDS}
+    projection['_id'] = 0
+    yield from collection.find(match, projection, batch_size=batch_size)
+
+# Group records into lists of batch_size so each batch is written in one go
+def batches(records, batch_size=BATCH_SIZE):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def coerce(field, value):
+    if value is None or value == "":
+        return None
+    if field in INTEGER_FIELDS:
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+    if field in BOOLEAN_FIELDS:
+        return bool(value)
+    return str(value)
+
+def write_parquet(path, record_batches):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    schema = pa.schema([(field, pa.int64() if field in INTEGER_FIELDS else pa.bool_() if field in BOOLEAN_FIELDS else pa.string())
+                        for field in EXPORT_FIELDS])
+    rows = 0
+    with pq.ParquetWriter(path, schema, compression="zstd") as writer:
+        for batch in record_batches:
+            columns = {field: [coerce(field, record.get(field)) for record in batch] for field in EXPORT_FIELDS}
+            writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+            rows += len(batch)
+    return rows
+
+def write_csv(path, record_batches):
+    rows = 0
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=EXPORT_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        for batch in record_batches:
+            writer.writerows(batch)
+            rows += len(batch)
+    return rows
+
+WRITERS = {".parquet": write_parquet, ".csv": write_csv}
+
+def condition_key(field):
+    return {"$ifNull": [f"${field}", "unknown"]}
+
+# Participants, mean, standard deviation and count of both ratings, and the mean change from the first
+# rating to the test rating, per condition
+def rating_summary_pipeline(match, by):
+    def stats(field):
+        return {
+            f"{field}_n": {"$sum": {"$cond": [{"$isNumber": f"${field}"}, 1, 0]}},
+            f"{field}_mean": {"$avg": f"${field}"},
+            f"{field}_sd": {"$stdDevSamp": f"${field}"},
+            f"{field}_min": {"$min": f"${field}"},
+            f"{field}_max": {"$max": f"${field}"},
+        }
+
+    return [
+        {"$match": match},
+        {"$group": {
+            "_id": condition_key(by),
+            "participants": {"$sum": 1},
+            **stats("rating"),
+            **stats("additional_rating"),
+            "rating_change_mean": {"$avg": {"$subtract": ["$additional_rating", "$rating"]}},
+        }},
+        {"$sort": {"_id": 1}},
+    ]
+
+# How many participants gave each rating value, per condition
+def rating_distribution_pipeline(match, by):
+    def distribution(field):
+        return [
+            {"$match": {field: {"$type": "number"}}},
+            {"$group": {"_id": {"condition": condition_key(by), "value": f"${field}"}, "count": {"$sum": 1}}},
+            {"$sort": {"_id.condition": 1, "_id.value": 1}},
+        ]
+
+    return [
+        {"$match": match},
+        {"$facet": {"rating": distribution("rating"), "additional_rating": distribution("additional_rating")}},
+    ]
+
+# How the confirmed final prompt relates to the participant's own prompt and to the suggested rewrite:
+# share kept as written, share taking the suggestion verbatim, share edited, and word/character counts
+def prompt_edit_pipeline(match, by):
+    def trimmed(field):
+        return {"$trim": {"input": {"$ifNull": [f"${field}", ""]}}}
+
+    def words(field):
+        return {"$size": {"$regexFindAll": {"input": f"${field}", "regex": r"\S+"}}}
+
+    def share(condition):
+        return {"$avg": {"$cond": [condition, 1, 0]}}
+
+    return [
+        {"$match": {**match, "final_prompt": {"$nin": [None, ""]}}},
+        {"$project": {
+            "condition": condition_key(by),
+            "user": trimmed("user_prompt"),
+            "suggestion": trimmed("inclusive_suggestion"),
+            "final": trimmed("final_prompt"),
+        }},
+        {"$project": {
+            "condition": 1,
+            "kept_own_prompt": {"$eq": ["$final", "$user"]},
+            "took_suggestion": {"$eq": ["$final", "$suggestion"]},
+            "user_words": words("user"),
+            "final_words": words("final"),
+            "user_chars": {"$strLenCP": "$user"},
+            "final_chars": {"$strLenCP": "$final"},
+        }},
+        {"$group": {
+            "_id": "$condition",
+            "prompts": {"$sum": 1},
+            "kept_own_prompt_share": share("$kept_own_prompt"),
+            "took_suggestion_share": share("$took_suggestion"),
+            "edited_share": share({"$not": [{"$or": ["$kept_own_prompt", "$took_suggestion"]}]}),
+            "user_words_mean": {"$avg": "$user_words"},
+            "final_words_mean": {"$avg": "$final_words"},
+            "word_change_mean": {"$avg": {"$subtract": ["$final_words", "$user_words"]}},
+            "user_chars_mean": {"$avg": "$user_chars"},
+            "final_chars_mean": {"$avg": "$final_chars"},
+        }},
+        {"$sort": {"_id": 1}},
+    ]
+
+def summarize(collection, match, by):
+    distribution = next(collection.aggregate(rating_distribution_pipeline(match, by)))
+    return {
+        'condition_field': by,
+        'ratings': list(collection.aggregate(rating_summary_pipeline(match, by))),
+        'rating_distribution': {field: [{'condition': entry['_id']['condition'], 'value': entry['_id']['value'], 'count': entry['count']}
+                                        for entry in entries]
+                                for field, entries in distribution.items()},
+        'prompt_edits': list(collection.aggregate(prompt_edit_pipeline(match, by))),
+    }
+
+def drive_file_id(link):
+    match = re.search(r"/d/([\w-]+)", link) or re.search(r"[?&]id=([\w-]+)", link)
+    return match.group(1) if match else None
+
+# Extension of an image from its link or file name, else from its MIME type (Drive links have neither
+# in the link: the archived format, JPEG or WebP, is in the Drive file's metadata)
+def image_extension(name, mimetype=None):
+    extension = os.path.splitext(name.split("?")[0])[1].lower()
+    if extension in IMAGE_EXTENSIONS.values() or extension == ".jpeg":
+        return extension
+    return IMAGE_EXTENSIONS.get(mimetype, ".jpg")
+
+def downloaded_image(directory, name):
+    paths = [path for path in glob.glob(os.path.join(glob.escape(directory), glob.escape(name) + ".*")) if not path.endswith(".part")]
+    return paths[0] if paths else None
+
+# Fetch one archived image: Drive links through the Drive API, local store files by copying,
+# other http(s) links (OpenAI URLs, public store URLs) by a streamed download
+def fetch_image(link, directory, name):
+    if downloaded_image(directory, name):
+        return False
+    tmp_path = os.path.join(directory, f"{name}.part")
+    if link.startswith("file://"):
+        extension = image_extension(link)
+        shutil.copyfile(link[len("file://"):], tmp_path)
+    elif "drive.google.com" in link:
+        from google_drive_utils import download_drive_file, get_drive_file_metadata
+        file_id = drive_file_id(link)
+        metadata = get_drive_file_metadata(file_id)
+        extension = image_extension(metadata.get('name', ""), metadata.get('mimeType'))
+        with open(tmp_path, "wb") as f:
+            download_drive_file(file_id, f)
+    elif link.startswith(("http://", "https://")):
+        import requests
+        with requests.get(link, stream=True, timeout=(10, 60)) as response:
+            response.raise_for_status()
+            extension = image_extension(link, response.headers.get("Content-Type", "").split(";")[0])
+            with open(tmp_path, "wb") as f:
+                shutil.copyfileobj(response.raw, f)
+    else:
+        raise ValueError(f"Unsupported image link {link}")
+    os.replace(tmp_path, os.path.join(directory, name + extension))
+    return True
+
+def fetch_images(images, directory, workers):
+    def fetch(image):
+        link, name = image
+        try:
+            return fetch_image(link, directory, name)
+        except Exception as e:
+            print(f"Could not fetch {name}: {e}", file=sys.stderr)
+            return None
+
+    with ThreadPoolExecutor(workers) as executor:
+        results = list(executor.map(fetch, images))
+    return {'fetched': results.count(True), 'existing': results.count(False), 'failed': results.count(None)}
+
+# Image links of a batch of records and the file names they are saved under
+def batch_images(batch):
+    return [(record[field], f"{record.get('prolific_id', 'unknown')}_{suffix}")
+            for record in batch for field, suffix in IMAGE_FIELDS.items() if record.get(field)]
+
+def print_table(rows, columns):
+    print("  ".join(f"{column:>14}" for column in columns))
+    for row in rows:
+        print("  ".join(f"{value:>14.3f}" if isinstance(value, float) else f"{str(value):>14}"
+                        for value in (row.get(column) for column in columns)))
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the InclusiArt AI study records")
+    parser.add_argument("output", help="records file, .parquet or .csv")
+    parser.add_argument("--all", action="store_true", help="include sessions that have not been completed")
+    parser.add_argument("--exclude-fallback", action="store_true",
+                        help="leave out sessions whose combined analysis fell back to the two-call path")
+    parser.add_argument("--by", default="analysis_mode", help="record field that defines the conditions of the summary")
+    parser.add_argument("--summary", help="compute the per-condition summary on the server and write it to this JSON file")
+    parser.add_argument("--images", help="also download the linked images into this directory")
+    parser.add_argument("--workers", type=int, default=16, help="parallel image downloads")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--mongo-uri", help="defaults to mongo.uri in .streamlit/secrets.toml")
+    args = parser.parse_args()
+
+    writer = WRITERS.get(os.path.splitext(args.output)[1].lower())
+    if writer is None:
+        parser.error("the output file must end in .parquet or .csv")
+    collection = get_collection(args.mongo_uri or st.secrets["mongo"]["uri"])
+    match = record_filter(args.all, args.exclude_fallback)
+
+    # Fetch each batch's images while the records stream past, instead of reading the collection twice
+    # or holding every link of the export
+    images = {'fetched': 0, 'existing': 0, 'failed': 0, 'seconds': 0.0}
+
+    def record_batches():
+        if args.images:
+            os.makedirs(args.images, exist_ok=True)
+        for batch in batches(stream_records(collection, match, args.batch_size), args.batch_size):
+            if args.images:
+                start = time.perf_counter()
+                for key, value in fetch_images(batch_images(batch), args.images, args.workers).items():
+                    images[key] += value
+                images['seconds'] += time.perf_counter() - start
+            yield batch
+
+    start = time.perf_counter()
+    rows = writer(args.output, record_batches())
+    print(f"Exported {rows} records to {args.output} in {time.perf_counter() - start:.1f}s")
+    if args.images:
+        print(f"Images: {images['fetched']} fetched, {images['existing']} already present, {images['failed']} failed "
+              f"in {images['seconds']:.1f}s")
+
+    if args.summary:
+        summary = summarize(collection, match, args.by)
+        print(f"\nRatings by {args.by}")
+        print_table([{'condition': row['_id'], **row} for row in summary['ratings']],
+                    ['condition', 'participants', 'rating_mean', 'rating_sd', 'additional_rating_mean', 'additional_rating_sd', 'rating_change_mean'])
+        print(f"\nPrompt edits by {args.by}")
+        print_table([{'condition': row['_id'], **row} for row in summary['prompt_edits']],
+                    ['condition', 'prompts', 'kept_own_prompt_share', 'took_suggestion_share', 'edited_share', 'word_change_mean'])
+        with open(args.summary, "w") as f:
+            json.dump(summary, f, indent=2, default=str)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,30 +1,102 @@
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseUpload
+from googleapiclient.http import MediaIoBaseDownload, MediaIoBaseUpload
+import google_auth_httplib2
+import httplib2
 import io
+import threading
 import streamlit as st
+import metrics
 
 SCOPES = ['https://www.googleapis.com/auth/drive.file']
+DRIVE_FOLDER_ID = '1wztu_GoG1bgUhZIl9da0nUl_1e6sSYKx'  # Default folder; set google_drive.folder_id in secrets.toml to use another
+HTTP_TIMEOUT = 60
+# Uploads larger than this use a resumable session; study images are far below it and go in one multipart request
+RESUMABLE_THRESHOLD = 5 * 1024 * 1024
 
-def get_drive_service():
-    creds = service_account.Credentials.from_service_account_info(
+_thread_local = threading.local()
+
+@st.cache_resource(show_spinner=False)
+def get_drive_credentials():
+    return service_account.Credentials.from_service_account_info(
         st.secrets["google_service_account"], scopes=SCOPES)
-    return build('drive', 'v3', credentials=creds)
 
-def upload_image_to_drive(image_bytes, filename):
+# The Drive client is built once per process (static discovery document, no network call)
+@st.cache_resource(show_spinner=False)
+def get_drive_service():
+    return build('drive', 'v3', credentials=get_drive_credentials(), cache_discovery=False)
+
+# httplib2 connections are not thread-safe, so each thread keeps its own authorized keep-alive connection
+def get_authorized_http():
+    http = getattr(_thread_local, 'http', None)
+    if http is None:
+        http = google_auth_httplib2.AuthorizedHttp(get_drive_credentials(), http=httplib2.Http(timeout=HTTP_TIMEOUT))
+        _thread_local.http = http
+    return http
+
+def drive_folder_id():
+    return st.secrets.get("google_drive", {}).get("folder_id", DRIVE_FOLDER_ID)
+
+# When the folder is already shared as "Anyone with the link" (google_drive.folder_is_public = true in secrets.toml),
+# uploaded files inherit that access and no per-file permission request is needed
+def folder_is_public():
+    return bool(st.secrets.get("google_drive", {}).get("folder_is_public", False))
+
+# Make files publicly readable with a single batched request
+def share_files_publicly(file_ids):
+    service = get_drive_service()
+    errors = []
+
+    def collect_error(request_id, response, exception):
+        if exception is not None:
+            errors.append(exception)
+
+    batch = service.new_batch_http_request(callback=collect_error)
+    for file_id in file_ids:
+        batch.add(service.permissions().create(
+            fileId=file_id,
+            body={'type': 'anyone', 'role': 'reader'},
+            fields='id'
+        ))
+    with metrics.span("drive_permissions"):
+        batch.execute(http=get_authorized_http())
+    if errors:
+        raise errors[0]
+
+# Upload an image from a binary file object positioned at its start (read in place, not copied);
+# returns the Drive file's id and webViewLink
+def create_drive_file(image_file, filename, mimetype='image/jpeg', folder_id=None):
     service = get_drive_service()
     file_metadata = {
         'name': filename,
-        'parents': ['1wztu_GoG1bgUhZIl9da0nUl_1e6sSYKx']  # Replace with your Google Drive folder ID
+        'parents': [folder_id or drive_folder_id()]
     }
-    media = MediaIoBaseUpload(io.BytesIO(image_bytes), mimetype='image/jpeg', resumable=True)
-    file = service.files().create(body=file_metadata, media_body=media, fields='id, webViewLink').execute()
-    
+    size = image_file.seek(0, io.SEEK_END)
+    image_file.seek(0)
+    media = MediaIoBaseUpload(image_file, mimetype=mimetype, resumable=size > RESUMABLE_THRESHOLD)
+    with metrics.span("drive_upload"):
+        return service.files().create(body=file_metadata, media_body=media, fields='id, webViewLink').execute(
+            http=get_authorized_http())
+
+def upload_image_to_drive(image_file, filename, mimetype='image/jpeg', folder_id=None):
+    file = create_drive_file(image_file, filename, mimetype, folder_id)
+
     # Make the file publicly accessible
-    service.permissions().create(
-        fileId=file['id'],
-        body={'type': 'anyone', 'role': 'reader'},
-        fields='id'
-    ).execute()
-    
-    return file.get('webViewLink')
\ No newline at end of file
+    if not folder_is_public():
+        share_files_publicly([file['id']])
+
+    return file.get('webViewLink')
+
+# Download a Drive file into a binary file object in chunks, on this thread's own connection
+def download_drive_file(file_id, file):
+    request = get_drive_service().files().get_media(fileId=file_id)
+    request.http = get_authorized_http()
+    downloader = MediaIoBaseDownload(file, request)
+    done = False
+    with metrics.span("drive_download"):
+        while not done:
+            _, done = downloader.next_chunk()
+
+# Name and MIME type of a Drive file
+def get_drive_file_metadata(file_id):
+    return get_drive_service().files().get(fileId=file_id, fields='name, mimeType').execute(http=get_authorized_http())
@@ -0,0 +1,214 @@
+import abc
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import streamlit as st
+import metrics
+
+# Where archived images are stored, chosen with backend in the image_storage section of secrets.toml:
+#   backend = "drive" (default): one upload per image to a Google Drive folder (folder_id)
+#   backend = "local": content-addressed files under path, e.g. for lab deployments; push them to Drive
+#             later with python image_storage.py sync-to-drive
+#   backend = "s3": content-addressed objects in an S3-compatible bucket (bucket, prefix, endpoint_url,
+#             region_name), needs boto3 (pip install boto3)
+# Local and S3 links use public_url as their base when it is set.
+
+# Drive batch requests are limited to 100 calls
+DRIVE_BATCH_SIZE = 100
+
+class ImageStore(abc.ABC):
+    # Store an encoded image held in an io.BytesIO and return the link saved with the participant's record
+    @abc.abstractmethod
+    def put(self, image_file, filename, mimetype):
+        pass
+
+    # Open the backend's connection ahead of the first upload (used by the app's warm-up)
+    def connect(self):
+        pass
+
+class DriveImageStore(ImageStore):
+    def __init__(self, folder_id=None):
+        self.folder_id = folder_id
+
+    def connect(self):
+        from google_drive_utils import get_drive_service
+        get_drive_service()
+
+    def put(self, image_file, filename, mimetype):
+        from google_drive_utils import upload_image_to_drive
+        return upload_image_to_drive(image_file, filename, mimetype, self.folder_id)
+
+# Files are named by the sha256 of their content, so byte-identical images are written once. Each put
+# appends its filename to index.jsonl, which sync-to-drive reads to name the uploads.
+class LocalImageStore(ImageStore):
+    def __init__(self, path="image_store", public_url=None):
+        self.root = os.path.abspath(path)
+        self.public_url = public_url
+        self._index_lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    def relative_path(self, digest, filename):
+        return os.path.join(digest[:2], digest + os.path.splitext(filename)[1])
+
+    def link(self, relative_path):
+        if self.public_url:
+            return f"{self.public_url.rstrip('/')}/{relative_path.replace(os.sep, '/')}"
+        return f"file://{os.path.join(self.root, relative_path)}"
+
+    def put(self, image_file, filename, mimetype):
+        with image_file.getbuffer() as data:
+            digest = hashlib.sha256(data).hexdigest()
+            relative_path = self.relative_path(digest, filename)
+            path = os.path.join(self.root, relative_path)
+            with metrics.span("local_image_write"):
+                if os.path.exists(path):
+                    metrics.count("image_store_deduplicated")
+                else:
+                    self._write_atomically(path, data)
+        self._append_index({'name': filename, 'sha256': digest, 'path': relative_path,
+                            'mimetype': mimetype, 'stored_at': time.time()})
+        return self.link(relative_path)
+
+    # Write to a temporary file in the target directory and rename it, so readers never see a partial image
+    def _write_atomically(self, path, data):
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def _append_index(self, entry):
+        with self._index_lock, open(os.path.join(self.root, "index.jsonl"), "a") as f:
+            f.write(json.dumps(entry) + "\n")
+
+    def entries(self, name="index.jsonl"):
+        path = os.path.join(self.root, name)
+        if not os.path.exists(path):
+            return []
+        with open(path) as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+class S3ImageStore(ImageStore):
+    def __init__(self, bucket, prefix="", endpoint_url=None, region_name=None, public_url=None):
+        import boto3
+        self.client = boto3.client("s3", endpoint_url=endpoint_url, region_name=region_name)
+        self.bucket = bucket
+        self.prefix = prefix
+        self.public_url = public_url
+
+    def link(self, key):
+        if self.public_url:
+            return f"{self.public_url.rstrip('/')}/{key}"
+        return f"s3://{self.bucket}/{key}"
+
+    def exists(self, key):
+        from botocore.exceptions import ClientError
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+            return True
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+    def put(self, image_file, filename, mimetype):
+        with image_file.getbuffer() as data:
+            digest = hashlib.sha256(data).hexdigest()
+        key = f"{self.prefix}{digest}{os.path.splitext(filename)[1]}"
+        with metrics.span("s3_upload"):
+            if self.exists(key):
+                metrics.count("image_store_deduplicated")
+            else:
+                image_file.seek(0)
+                self.client.upload_fileobj(image_file, self.bucket, key,
+                                           ExtraArgs={'ContentType': mimetype, 'Metadata': {'filename': filename}})
+        return self.link(key)
+
+BACKENDS = {
+    "drive": DriveImageStore,
+    "local": LocalImageStore,
+    "s3": S3ImageStore,
+}
+
+# One store per server process, shared by the archive workers
+@st.cache_resource(show_spinner=False)
+def get_image_store():
+    config = dict(st.secrets.get("image_storage", {}))
+    return BACKENDS[config.pop("backend", "drive")](**config)
+
+# Upload every image of a local store that is not on Drive yet, once per distinct content, and grant the
+# public permissions in batches. drive_links.jsonl records each upload (sha256, name, Drive id and link) and,
+# on a later line once its permission is granted, that it is shared; the last line per image wins. A rerun
+# skips the uploaded images and shares the ones still private. Failed uploads and permission batches are
+# returned as (name, exception) pairs instead of stopping the sync.
+def sync_to_drive(store, folder_id=None, workers=8):
+    import google_drive_utils
+    needs_sharing = not google_drive_utils.folder_is_public()
+    links = {link['sha256']: link for link in store.entries("drive_links.jsonl")}
+    pending = {}
+    for entry in store.entries():
+        if entry['sha256'] not in links:
+            pending.setdefault(entry['sha256'], entry)
+    lock = threading.Lock()
+
+    def record(link):
+        with lock, open(os.path.join(store.root, "drive_links.jsonl"), "a") as f:
+            f.write(json.dumps(link) + "\n")
+            links[link['sha256']] = link
+
+    def upload(entry):
+        with open(os.path.join(store.root, entry['path']), "rb") as image_file:
+            file = google_drive_utils.create_drive_file(image_file, entry['name'], entry['mimetype'], folder_id)
+        record({'sha256': entry['sha256'], 'name': entry['name'], 'id': file['id'],
+                'link': file.get('webViewLink'), 'shared': not needs_sharing})
+
+    failures = []
+    with ThreadPoolExecutor(workers) as executor:
+        futures = [(executor.submit(upload, entry), entry) for entry in pending.values()]
+        for future, entry in futures:
+            if future.exception() is not None:
+                failures.append((entry['name'], future.exception()))
+    uploaded = len(pending) - len(failures)
+    if needs_sharing:
+        unshared = [link for link in links.values() if not link['shared']]
+        for start in range(0, len(unshared), DRIVE_BATCH_SIZE):
+            batch = unshared[start:start + DRIVE_BATCH_SIZE]
+            try:
+                google_drive_utils.share_files_publicly([link['id'] for link in batch])
+            except Exception as e:
+                failures.extend((link['name'], e) for link in batch)
+                continue
+            for link in batch:
+                record({**link, 'shared': True})
+    return uploaded, failures
+
+# Push a local store to Drive (reads the image_storage and google_drive settings from .streamlit/secrets.toml):
+#   python image_storage.py sync-to-drive [--path image_store] [--folder-id ID]
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the archived study images")
+    parser.add_argument("command", choices=("sync-to-drive",))
+    parser.add_argument("--path", help="local store directory (default: image_storage.path)")
+    parser.add_argument("--folder-id", help="Drive folder (default: google_drive.folder_id)")
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+    store = LocalImageStore(args.path or st.secrets.get("image_storage", {}).get("path", "image_store"))
+    uploaded, failures = sync_to_drive(store, args.folder_id, args.workers)
+    print(f"Uploaded {uploaded} images to Drive")
+    for name, error in failures:
+        print(f"Failed: {name}: {error!r}")
+    if failures:
+        print(f"{len(failures)} images were not synced, run the command again to retry them")
+        raise SystemExit(1)
@@ -1,25 +1,76 @@
 import streamlit as st
-from openai import OpenAI
+import base64
+import functools
+import io
 import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 import sqlite3
-import requests
-import pymongo
-from pymongo import MongoClient
-from google_drive_utils import upload_image_to_drive
-
-# Initialize OpenAI client with API key
-client = OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
+from archival import submit_archive, archived_link, resolve_archive, encode_image
+from profession_pool import ProfessionPool
+from session_snapshot import SessionSnapshot
+from prompt_analysis import (ANALYSIS_MODE, get_openai_client, get_openai_scheduler, run_openai_request,
+                             get_bias_example, suggest_inclusive_prompt, stream_bias_and_suggestion)
+import metrics
+
+# The OpenAI, MongoDB and Google Drive clients (and their imports) are created on first use rather than
+# at import, so a cold app process draws the first page without waiting for them; see start_warm_up below
+
+# Unfinished sessions can be resumed for this long after their last step
+SNAPSHOT_TTL_SECONDS = 7 * 24 * 3600
+# Completion codes are the 4-digit numbers, handed out in a fixed scrambled order: the n-th code is
+# COMPLETION_CODE_RANGE[(n * COMPLETION_CODE_STRIDE) % len(COMPLETION_CODE_RANGE)], the stride being coprime to 9000
+COMPLETION_CODE_RANGE = range(1000, 10000)
+COMPLETION_CODE_STRIDE = 7919
+
+# Create the indexes used by the existence checks and the completion codes (no-op when they already exist)
+def setup_indexes(db):
+    import pymongo
+    with metrics.span("mongo_setup_indexes"):
+        try:
+            db['inclusive_data'].create_index("prolific_id", unique=True)
+        except pymongo.errors.OperationFailure as e:
+            print(f"Could not create the unique prolific_id index, remove duplicate records first: {e}")
+        # Covers the completed filter of the Prolific ID check and of the completing upsert
+        db['inclusive_data'].create_index([("prolific_id", pymongo.ASCENDING), ("completed", pymongo.ASCENDING)])
+        # Only records that were given a code are indexed, so the database rejects a code handed out twice
+        db['inclusive_data'].create_index("random_code", unique=True, partialFilterExpression={"random_code": {"$exists": True}})
+        db['session_snapshots'].create_index("updated_at", expireAfterSeconds=SNAPSHOT_TTL_SECONDS)
 
 # MongoDB Setup
-@st.cache_resource
+@st.cache_resource(show_spinner=False)
 def get_mongo_connection():
+    from pymongo import MongoClient
     # Connect to MongoDB using credentials from secrets.toml
     client = MongoClient(st.secrets["mongo"]["uri"])
     db = client['inclusiai_db']  # Database name
+    setup_indexes(db)
+    start_metrics_exporter(db)
     return db
 
-db = get_mongo_connection()
-user_data_collection = db['inclusive_data']  # Collection name
+# Export this process's latency histograms to the metrics collection (read by admin_dashboard.py)
+# and, if metrics.prometheus_path is set in secrets.toml, to a Prometheus text file per process next to that path
+@st.cache_resource(show_spinner=False)
+def start_metrics_exporter(_db):
+    config = st.secrets.get("metrics", {})
+    return metrics.start_exporter(_db['metrics'], config.get("prometheus_path"), config.get("export_interval", 10))
+
+def get_user_data_collection():
+    return get_mongo_connection()['inclusive_data']  # Collection name
+
+def get_snapshot_collection():
+    return get_mongo_connection()['session_snapshots']
+
+def get_counter_collection():
+    return get_mongo_connection()['counters']
+
+# Opt-in: start generating the suggested prompt's image while the participant decides on the final prompt
+SPECULATIVE_GENERATION = st.secrets.get("speculative_generation", False)
+
+
 
 # SQLite Database Setup
 # def setup_database():
@@ -80,125 +131,241 @@ user_data_collection = db['inclusive_data']  # Collection name
 #         if not check_random_code_exists(random_code):
 #             return random_code
 
+# Per-step progress is upserted in batches by a background writer; tune it with the progress_writes
+# section of secrets.toml (batch_size, flush_interval in seconds, write_concern e.g. {w = 1})
+@st.cache_resource
+def get_progress_writer():
+    from progress_writer import ProgressWriter
+    return ProgressWriter(get_user_data_collection(), on_insert={"completed": False}, **st.secrets.get("progress_writes", {}))
+
+@st.cache_resource
+def get_snapshot_writer():
+    from progress_writer import ProgressWriter
+    return ProgressWriter(get_snapshot_collection(), key_field="_id", **st.secrets.get("progress_writes", {}))
+
+# Snapshot the session so a reload or dropped connection resumes at the same step
+def save_snapshot():
+    get_snapshot_writer().update(st.session_state['prolific_id'], SessionSnapshot.from_session_state(st.session_state).to_document())
+
+def load_snapshot(prolific_id):
+    with metrics.span("mongo_find_snapshot"):
+        document = get_snapshot_collection().find_one({"_id": prolific_id})
+    return SessionSnapshot.from_document(document) if document else None
+
+# Queue this participant's latest step fields for the next batched write
+def record_progress(**fields):
+    get_progress_writer().update(st.session_state['prolific_id'], fields)
+    save_snapshot()
+
+# Attach the Drive link to the participant's record and snapshot as soon as the background upload finishes
+def record_archived_link(image_upload, prolific_id, field):
+    progress_writer = get_progress_writer()
+    snapshot_writer = get_snapshot_writer()
+
+    def on_done(future):
+        if future.exception() is None and future.result():
+            progress_writer.update(prolific_id, {field: future.result()})
+            snapshot_writer.update(prolific_id, {field: future.result()})
+
+    image_upload.add_done_callback(on_done)
+
+# Mark the participant's record as completed in one upsert (carrying all fields in case buffered progress
+# has not been flushed yet). A Prolific ID that has already completed matches no in-progress record,
+# so the upsert's insert is rejected by the unique prolific_id index, including for concurrent submissions.
 def insert_user_data(data):
+    import pymongo
     try:
-        user_data_collection.insert_one(data)
+        with metrics.span("mongo_complete_record"):
+            get_user_data_collection().update_one(
+                {"prolific_id": data['prolific_id'], "completed": False},
+                {"$set": {**data, "completed": True}},
+                upsert=True
+            )
+        metrics.count("sessions_completed")
         return True
+    except pymongo.errors.DuplicateKeyError:
+        st.error("Error: This Prolific ID has already been used.")
+        return False
     except Exception as e:
         st.error(f"Error inserting data: {e}")
         return False
 
+# Answered from the (prolific_id, completed) index without fetching any document.
+# In-progress records do not count; records saved before progress tracking have no completed field.
 def check_prolific_id_exists(prolific_id):
-    return user_data_collection.find_one({"prolific_id": prolific_id}) is not None
-
-def check_random_code_exists(random_code):
-    return user_data_collection.find_one({"random_code": random_code}) is not None
+    with metrics.span("mongo_check_prolific_id"):
+        return get_user_data_collection().count_documents({"prolific_id": prolific_id, "completed": {"$ne": False}}, limit=1) > 0
 
+# Atomically take the next completion code: one round-trip however many codes are already in use.
+# The counter document is created by the first allocation, so nothing is seeded up front.
 def generate_unique_random_code():
-    while True:
-        random_code = random.randint(1000, 9999)
-        if not check_random_code_exists(random_code):
-            return random_code
-
-
-# Function to get bias example from OpenAI using ChatCompletion API
-def get_bias_example(user_prompt):
-    response = client.chat.completions.create(
+    from pymongo import ReturnDocument
+    with metrics.span("mongo_allocate_code"):
+        counter = get_counter_collection().find_one_and_update(
+            {"_id": "completion_code"},
+            {"$inc": {"allocated": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    index = counter['allocated'] - 1
+    if index >= len(COMPLETION_CODE_RANGE):
+        raise RuntimeError("All completion codes have been handed out")
+    return COMPLETION_CODE_RANGE[(index * COMPLETION_CODE_STRIDE) % len(COMPLETION_CODE_RANGE)]
+
+
+# Function to generate a batch of professions for one category of the test pool
+@metrics.step("profession_pool_refill")
+def get_profession_batch(category, examples, count=20):
+    response = run_openai_request("chat", get_openai_client().chat.completions.with_raw_response.create,
         model="gpt-4o-mini",
         messages=[
-            {"role": "system", "content": """You are an expert in identifying unconscious bias, stereotypes, and representation issues in character descriptions. Focus on detecting subtle biases related to:
-- Gender roles and expectations
-- Cultural and ethnic stereotypes
-- Physical appearance assumptions
-- Age-related prejudices
-- Socioeconomic stereotypes
-Provide specific, concrete examples of potential biases."""},
-            {"role": "user", "content": f"Analyze this character description: '{user_prompt}'. In one clear, specific sentence, identify the most significant potential bias or stereotype that could emerge in the visual representation."}
+            {"role": "system", "content": f"""Generate {count} distinct common professions in the category: {category} (for example: {', '.join(examples)}).
+Provide only the profession names, one per line, without numbering, context or explanation."""},
+            {"role": "user", "content": "Generate common professions that would require careful description."}
         ],
-        max_tokens=100,
+        max_tokens=300,
         temperature=0.7
     )
-    return response.choices[0].message.content
+    lines = response.choices[0].message.content.splitlines()
+    return [line.strip(" -*.0123456789").strip() for line in lines if line.strip()]
 
-# Function to provide more inclusive alternatives for the user's prompt
-def suggest_inclusive_prompt(user_prompt,bias_example):
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": """You are an expert in rewriting character descriptions to be more inclusive. Your task is to:
-- Keep the exact same character concept
-- Remove potentially biased language
-Provide only the rewritten prompt without any explanation."""},
-            {"role": "user", "content": f"Rewrite this character description to be more inclusive while keeping the same core concept: '{user_prompt}'. Address this specific bias: '{bias_example}'. Dont print text like 'Rewrite:' before the description"}
-        ],
-        max_tokens=100,
-        temperature=0.7
-    )
-    return response.choices[0].message.content
-
-# Function to get random object from OpenAI using ChatCompletion API
-def get_random_object(user_prompt):
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": """Generate a single common profession from these categories:
-- Service workers (waiter, cashier, receptionist)
-- Office workers (accountant, secretary)
-- Healthcare workers (nurse, doctor)
-- Education (teacher, professor)
-- Trade workers (plumber, electrician)
-- Business professionals (manager, salesperson)
-Provide only the profession name without any context or explanation."""},
-            {"role": "user", "content": "Generate a single common profession that would require careful description."}
-        ],
-        max_tokens=100,
-        temperature=0.7
-    )
-    return response.choices[0].message.content
-
-# Function to generate an image using DALL·E 3 API and upload to Google Drive
-def generate_image(final_prompt, prolific_id):
-    response = client.images.generate(
+# Test profession pool shared across sessions; assignment counts are seeded from saved records
+# so categories stay balanced across server restarts
+@st.cache_resource
+def get_profession_pool():
+    with metrics.span("mongo_profession_counts"):
+        assigned_counts = {
+            group['_id']: group['count']
+            for group in get_user_data_collection().aggregate([
+                {"$match": {"random_profession_category": {"$exists": True}}},
+                {"$group": {"_id": "$random_profession_category", "count": {"$sum": 1}}}
+            ])
+        }
+    metrics.count("profession_pool_created")
+    return ProfessionPool(get_profession_batch, assigned_counts=assigned_counts)
+
+# "url" (default) returns a link that the browser loads from OpenAI and the archive worker downloads;
+# "b64_json" returns the image in the response itself, saving the download: it is encoded once here,
+# and the encoded bytes are both displayed and archived. Set response_format in the images section of secrets.toml.
+IMAGE_RESPONSE_FORMAT = st.secrets.get("images", {}).get("response_format", "url")
+
+# Function to generate an image using DALL·E 3 API
+# Returns the image to display: its URL, or the encoded image bytes in b64_json mode
+def request_image(prompt):
+    response = run_openai_request("images", get_openai_client().images.with_raw_response.generate,
         model="dall-e-3",
-        prompt=final_prompt,
+        prompt=prompt,
         size="1024x1024",
-        quality="standard"
+        quality="standard",
+        response_format=IMAGE_RESPONSE_FORMAT
     )
-    image_url = response.data[0].url
-    
-    # Download the image
-    image_response = requests.get(image_url)
-    image_bytes = image_response.content
-    
-    # Upload to Google Drive
-    drive_link = upload_image_to_drive(image_bytes, f"{prolific_id}_prompted.jpg")
-    print(drive_link)
-    print(image_url)
-    return (drive_link,image_url)
-
+    if response.data[0].b64_json:
+        return encode_image(io.BytesIO(base64.b64decode(response.data[0].b64_json))).getvalue()
+    return response.data[0].url
+
+# Function to generate an image using DALL·E 3 API and queue its upload to the image store (Google Drive by default)
+# Returns the pending upload (a future resolving to the archived link) and the image to display right away.
+# A speculatively generated image is archived as is instead of generating a new one.
+@metrics.step("prompted_image")
+def generate_image(final_prompt, prolific_id, image=None):
+    if not image:
+        image = request_image(final_prompt)
+    return (submit_archive(image, f"{prolific_id}_prompted"),image)
+
+@metrics.step("test_image")
 def generate_test_image(final_prompt, prolific_id):
-    response = client.images.generate(
-        model="dall-e-3",
-        prompt=final_prompt,
-        size="1024x1024",
-        quality="standard"
+    image = request_image(final_prompt)
+    return (submit_archive(image, f"{prolific_id}_test"),image)
+
+@st.cache_resource
+def get_generation_executor():
+    return ThreadPoolExecutor(max_workers=8, thread_name_prefix="speculative-image")
+
+# Speculative generation outcomes are counted per process in the metrics, and saved with each session's record
+def record_speculation(outcome):
+    metrics.count(f"speculative_{outcome}")
+    st.session_state['speculative_outcome'] = outcome
+    record_progress(speculative_outcome=outcome)
+
+# Start generating the suggestion's image in the background as soon as the suggestion exists
+def start_speculative_image():
+    if SPECULATIVE_GENERATION and st.session_state['inclusive_suggestion'] and st.session_state['speculative_image'] is None:
+        with metrics.tags(step="speculative_image"):
+            speculative_request = metrics.with_current_tags(request_image)
+        st.session_state['speculative_image'] = get_generation_executor().submit(speculative_request, st.session_state['inclusive_suggestion'])
+
+# Use the speculative image if the confirmed prompt is the unchanged suggestion; otherwise cancel or discard it
+def claim_speculative_image(final_prompt):
+    future = st.session_state['speculative_image']
+    if future is None or st.session_state['speculative_outcome']:
+        return None
+    if final_prompt.strip() != st.session_state['inclusive_suggestion'].strip():
+        future.cancel()
+        record_speculation('miss')
+        return None
+    try:
+        image = future.result()
+    except Exception:
+        record_speculation('failed')
+        return None
+    record_speculation('hit')
+    return image
+
+# Attach the Drive links of uploads that have finished in the background
+def collect_archived_links():
+    for link_key, upload_key in (('image_url', 'image_upload'), ('test_image_url', 'test_image_upload')):
+        if not st.session_state[link_key]:
+            st.session_state[link_key] = archived_link(st.session_state[upload_key])
+
+# Wait for (or retry) uploads that are still pending so no Drive link is lost at save time
+def reconcile_archived_links():
+    uploads = (
+        ('image_url', 'image_upload', 'display_prompt_image', 'prompted'),
+        ('test_image_url', 'test_image_upload', 'display_test_image', 'test'),
     )
-    image_url = response.data[0].url
-    
-    # Download the image
-    image_response = requests.get(image_url)
-    image_bytes = image_response.content
-    
-    # Upload to Google Drive
-    drive_link = upload_image_to_drive(image_bytes, f"{prolific_id}_test.jpg")
-    print(drive_link)
-    return (drive_link,image_url)
+    for link_key, upload_key, display_key, suffix in uploads:
+        if not st.session_state[link_key] and st.session_state[upload_key] is not None:
+            st.session_state[link_key] = resolve_archive(
+                st.session_state[upload_key],
+                st.session_state[display_key],
+                f"{st.session_state['prolific_id']}_{suffix}"
+            )
+
+# Until the Drive link exists, the record keeps the OpenAI URL of the image (nothing for image bytes)
+def display_link(display_key):
+    image = st.session_state.get(display_key)
+    return image if isinstance(image, str) else ''
+
+# Open the connections a session needs later (MongoDB at step 2, OpenAI at step 5, image storage at step 7) on a
+# background thread once the first page is drawn, so that on a cold process they are usually ready in time.
+# Set warm_up = false in secrets.toml to connect lazily on first use only.
+@st.cache_resource(show_spinner=False)
+def start_warm_up():
+    def warm_up():
+        from image_storage import get_image_store
+        for name, connect in (("mongo", get_mongo_connection), ("openai", get_openai_client),
+                              ("openai_scheduler", get_openai_scheduler), ("image_store", lambda: get_image_store().connect())):
+            try:
+                with metrics.span(f"warm_up_{name}"):
+                    connect()
+            except Exception as e:
+                print(f"Warm-up of {name} failed: {e}")
+
+    if not st.secrets.get("warm_up", True):
+        return None
+    thread = threading.Thread(target=warm_up, daemon=True, name="warm-up")
+    thread.start()
+    return thread
 
 # Initialize session state variables
+if 'scheduler_session_id' not in st.session_state:
+    st.session_state['scheduler_session_id'] = str(uuid.uuid4())
 if 'inclusive_suggestion' not in st.session_state:
     st.session_state['inclusive_suggestion'] = ""
 if 'random_object' not in st.session_state:
     st.session_state['random_object'] = ""
+if 'analysis_fallback' not in st.session_state:
+    st.session_state['analysis_fallback'] = False
 if 'bias_example' not in st.session_state:
     st.session_state['bias_example'] = ""
 if 'final_confirmed' not in st.session_state:
@@ -207,6 +374,14 @@ if 'image_url' not in st.session_state:
     st.session_state['image_url'] = None
 if 'test_image_url' not in st.session_state:
     st.session_state['test_image_url'] = None
+if 'image_upload' not in st.session_state:
+    st.session_state['image_upload'] = None
+if 'test_image_upload' not in st.session_state:
+    st.session_state['test_image_upload'] = None
+if 'speculative_image' not in st.session_state:
+    st.session_state['speculative_image'] = None
+if 'speculative_outcome' not in st.session_state:
+    st.session_state['speculative_outcome'] = None
 if 'display_prompt_image' not in st.session_state:
     st.session_state['display_prompt_image'] = None
 if 'display_test_image' not in st.session_state:
@@ -231,206 +406,322 @@ if 'test_prompt_submitted' not in st.session_state:
     st.session_state['test_prompt_submitted'] = False
 if 'save_button_clicked' not in st.session_state:
     st.session_state['save_button_clicked'] = False
-    
 
-# Step 1: Introduce InclusiArt AI
-st.title("InclusiArt AI")
-st.write("""
-Welcome to InclusiArt AI! I am a text-to-image generative AI tool designed to help you bring your fantasy characters to life. Simply describe your character, and I'll generate an image based on your description.
-""")
+# Each study step below is a fragment that calls the next step once it is complete, so the steps nest.
+# A widget interaction reruns only the fragment it belongs to (its step and the steps after it) instead
+# of the whole script, which keeps the earlier steps, and their images, from being re-rendered.
+def study_step(function):
+    @st.fragment
+    @functools.wraps(function)
+    def step():
+        # Fragment reruns do not pass through the top of the script, so tag their spans here
+        metrics.set_tags(session=st.session_state.get('prolific_id') or st.session_state['scheduler_session_id'], step=None)
+        return function()
+    return step
+
+# Move on from a completed step. A fragment-scoped rerun is only allowed during a fragment rerun, so
+# fall back to a full rerun when the step was reached in a full script run (e.g. the first page load)
+def rerun_step():
+    ctx = get_script_run_ctx(suppress_warning=True)
+    if ctx is not None and ctx.fragment_ids_this_run:
+        st.rerun(scope="fragment")
+    st.rerun()
 
 # Step 2: Ask users for their Prolific ID
-if not st.session_state['prolific_id_submitted']:
-    prolific_id = str(st.text_input("What is your Prolific ID?", key="prolific_id_input"))
-    if prolific_id:
-        if check_prolific_id_exists(prolific_id):
-            st.error("Error: This Prolific ID has already been used. Please contact the researcher if you believe this is a mistake.")
-        else:
-            st.session_state['prolific_id'] = prolific_id
-            st.session_state['prolific_id_submitted'] = True
-            st.rerun()
-else:
-    st.text_input("What is your Prolific ID?", value=st.session_state['prolific_id'], disabled=True)
-
-if st.session_state['prolific_id_submitted']:
-    # Step 3: Ask users what they would like to draw
+@study_step
+def step_prolific_id():
+    if not st.session_state['prolific_id_submitted']:
+        prolific_id = str(st.text_input("What is your Prolific ID?", key="prolific_id_input"))
+        if prolific_id:
+            if check_prolific_id_exists(prolific_id):
+                st.error("Error: This Prolific ID has already been used. Please contact the researcher if you believe this is a mistake.")
+            else:
+                # Resume an unfinished session with its generated text and images instead of regenerating them
+                snapshot = load_snapshot(prolific_id)
+                if snapshot:
+                    snapshot.apply_to(st.session_state)
+                st.session_state['prolific_id'] = prolific_id
+                st.session_state['prolific_id_submitted'] = True
+                record_progress(analysis_mode=ANALYSIS_MODE)
+                metrics.count("sessions_started")
+                rerun_step()
+    else:
+        st.text_input("What is your Prolific ID?", value=st.session_state['prolific_id'], disabled=True)
+
+    if st.session_state['prolific_id_submitted']:
+        step_user_prompt()
+
+# Step 3: Ask users what they would like to draw
+@study_step
+def step_user_prompt():
     if not st.session_state['user_prompt_submitted']:
         user_prompt = st.text_input("What would you like to draw? Describe your fantasy character below:", key="initial_prompt_input")
         if user_prompt:
             st.session_state['user_prompt'] = user_prompt
             st.session_state['user_prompt_submitted'] = True
-            st.rerun()
+            record_progress(user_prompt=user_prompt)
+            rerun_step()
     else:
         st.text_input("What would you like to draw? Describe your fantasy character below:", value=st.session_state['user_prompt'], disabled=True)
 
     if st.session_state['user_prompt_submitted']:
-        # Step 4: Inform users about potential bias
-        st.write(f"You want to draw: {st.session_state['user_prompt']}")
-        st.warning("""
-        AI model may produce biased or stereotypical portrayals of characters due to the nature of its training data.
-        """)
-
-        # Step 5: Generate bias example and inclusive suggestion
-        if not st.session_state['inclusive_suggestion']:
+        step_final_prompt()
+
+# Steps 4-7: Show the bias analysis and suggestion, then ask for the final prompt
+@study_step
+def step_final_prompt():
+    # Step 4: Inform users about potential bias
+    st.write(f"You want to draw: {st.session_state['user_prompt']}")
+    st.warning("""
+    AI model may produce biased or stereotypical portrayals of characters due to the nature of its training data.
+    """)
+
+    # Step 5: Generate bias example and inclusive suggestion
+    if not st.session_state['inclusive_suggestion']:
+        if ANALYSIS_MODE == "sequential":
             with st.spinner('Analyzing your prompt for potential biases...'):
                 st.session_state['bias_example'] = get_bias_example(st.session_state['user_prompt'])
             with st.spinner('Suggesting more inclusive alternatives...'):
                 if st.session_state['bias_example']:
                     st.session_state['inclusive_suggestion'] = suggest_inclusive_prompt(st.session_state['user_prompt'],st.session_state['bias_example'])
+        else:
+            # Stream both fields to the page as they arrive, then hand over to the regular display below
+            bias_placeholder = st.empty()
+            suggestion_placeholder = st.empty()
+            result = {}
+            with st.spinner('Analyzing your prompt for potential biases...'):
+                for result in stream_bias_and_suggestion(st.session_state['user_prompt']):
+                    if result.get('bias_example'):
+                        bias_placeholder.write(f"Example of potential bias: {result['bias_example']}")
+                    if result.get('inclusive_suggestion'):
+                        suggestion_placeholder.code(result['inclusive_suggestion'])
+            bias_placeholder.empty()
+            suggestion_placeholder.empty()
+            st.session_state['bias_example'] = result.get('bias_example', '')
+            st.session_state['inclusive_suggestion'] = result.get('inclusive_suggestion', '')
+            st.session_state['analysis_fallback'] = result.get('analysis_fallback', False)
+        record_progress(bias_example=st.session_state['bias_example'], inclusive_suggestion=st.session_state['inclusive_suggestion'],
+                        analysis_fallback=st.session_state['analysis_fallback'])
+
+    if st.session_state['bias_example']:
+        st.write(f"Example of potential bias: {st.session_state['bias_example']}")
+
+    # Step 6: Display suggested inclusive prompt
+    st.write("Suggested Inclusive Prompt:")
+    st.code(st.session_state['inclusive_suggestion'])
+
+    # Step 7: Ask for final prompt before generating the image
+    if not st.session_state['final_confirmed']:
+        start_speculative_image()
+        final_prompt = st.text_input("Please confirm or modify your final prompt before generating the image:", value="")
+        if st.button("Confirm Final Prompt"):
+            if final_prompt.strip() == "":
+                final_prompt = st.session_state['inclusive_suggestion']
+            st.session_state['final_confirmed'] = True
+            st.session_state['final_prompt'] = final_prompt
+            record_progress(final_prompt=final_prompt)
+            rerun_step()
+
+    if st.session_state['final_confirmed']:
+        st.text_area("Final Prompt (Confirmed)", value=st.session_state['final_prompt'], height=100, disabled=True)
+        step_prompt_image()
+
+# Generate and display the image of the confirmed final prompt
+@study_step
+def step_prompt_image():
+    # A session resumed without its image (bytes in b64_json mode, or an expired OpenAI URL) keeps the archived image instead of a new one
+    if not st.session_state['display_prompt_image'] and not st.session_state['image_url']:
+        with st.spinner('Generating your image...'):
+            speculative_image = claim_speculative_image(st.session_state['final_prompt'])
+            image_upload, display_prompt_image = generate_image(st.session_state['final_prompt'], st.session_state['prolific_id'], speculative_image)
+            if display_prompt_image:
+                st.session_state['image_upload'] = image_upload
+                st.session_state['display_prompt_image'] = display_prompt_image
+                st.session_state['display_prompt_image_at'] = time.time()
+                record_archived_link(image_upload, st.session_state['prolific_id'], 'image_url')
+                save_snapshot()
+
+    # Display generated image result
+    if st.session_state['display_prompt_image']:
+        try:
+            st.image(st.session_state['display_prompt_image'], caption=f"Generated Image based on: {st.session_state['final_prompt']}", use_container_width=True)
+        except Exception as e:
+            st.error(f"Error displaying the image: {str(e)}")
+    elif st.session_state['image_url']:
+        st.write(f"Your generated image: {st.session_state['image_url']}")
+
+    step_rating()
+
+# Step 8: Ask for user feedback
+@study_step
+def step_rating():
+    rating_options = [1, 2, 3, 4, 5, 6, 7]
+    rating_disabled = st.session_state["feedback_given"]
+    rating = st.radio(
+        "How satisfied are you with the generated image? (1 being the lowest and 7 being the highest)",
+        options=rating_options,
+        index=None,
+        disabled=rating_disabled,
+        key="rating_radio"
+    )
 
-        if st.session_state['bias_example']:
-            st.write(f"Example of potential bias: {st.session_state['bias_example']}")
-
-        # Step 6: Display suggested inclusive prompt
-        st.write("Suggested Inclusive Prompt:")
-        st.code(st.session_state['inclusive_suggestion'])
-
-        # Step 7: Ask for final prompt before generating the image
-        if not st.session_state['final_confirmed']:
-            final_prompt = st.text_input("Please confirm or modify your final prompt before generating the image:", value="")
-            if st.button("Confirm Final Prompt"):
-                if final_prompt.strip() == "":
-                    final_prompt = st.session_state['inclusive_suggestion']
-                st.session_state['final_confirmed'] = True
-                st.session_state['final_prompt'] = final_prompt
-                st.rerun()
-
-        if st.session_state['final_confirmed']:
-            st.text_area("Final Prompt (Confirmed)", value=st.session_state['final_prompt'], height=100, disabled=True)
-
-            # Generate image based on confirmed final prompt
-            if not st.session_state['image_url']:
-                with st.spinner('Generating your image...'):
-                    image_url, display_prompt_image = generate_image(st.session_state['final_prompt'], st.session_state['prolific_id'])
-                    if image_url:
-                        st.session_state['image_url'] = image_url
-                        st.session_state['display_prompt_image'] = display_prompt_image
-
-            # Display generated image result
-            if st.session_state['image_url']:
-                try:
-                    st.image(st.session_state['display_prompt_image'], caption=f"Generated Image based on: {st.session_state['final_prompt']}", use_container_width=True)
-                except Exception as e:
-                    st.error(f"Error displaying the image: {str(e)}")
-
-            # Step 8: Ask for user feedback
-            rating_options = [1, 2, 3, 4, 5, 6, 7]
-            rating_disabled = st.session_state["feedback_given"]
-            rating = st.radio(
-                "How satisfied are you with the generated image? (1 being the lowest and 7 being the highest)",
-                options=rating_options,
-                index=None,
-                disabled=rating_disabled,
-                key="rating_radio"
-            )
+    if rating is not None and not rating_disabled:
+        st.session_state["rating"] = rating
+        st.session_state["feedback_given"] = True
+        record_progress(rating=rating)
+        st.write(f"Thank you for your feedback! You rated your satisfaction as: {rating}/7")
+        rerun_step()
+
+    if st.session_state["feedback_given"]:
+        step_additional_feedback()
+
+# Step 9: Ask for additional feedback
+@study_step
+def step_additional_feedback():
+    if not st.session_state['additional_feedback_submitted']:
+        additional_feedback = st.text_input("Any feedback about the inclusiveness of the AI-generated image?", key="additional_feedback_input")
+        if additional_feedback:
+            st.session_state['additional_feedback'] = additional_feedback
+            st.session_state['additional_feedback_submitted'] = True
+            record_progress(additional_feedback=additional_feedback)
+            rerun_step()
+    else:
+        st.text_input("Any feedback about the inclusiveness of the AI-generated image?", value=st.session_state['additional_feedback'], disabled=True)
+
+    if st.session_state['additional_feedback_submitted']:
+        step_test_prompt()
+
+# Step 10: Test user's understanding of inclusive prompting
+@study_step
+def step_test_prompt():
+    if not st.session_state['random_object']:
+        st.session_state['random_object_category'], st.session_state['random_object'] = get_profession_pool().pick()
+        record_progress(random_profession=st.session_state['random_object'], random_profession_category=st.session_state['random_object_category'])
+
+    st.write(f"Now, to test your understanding of inclusive prompting, write an inclusive prompt to generate an image of: **{st.session_state['random_object']}**")
+
+    if not st.session_state['test_prompt_submitted']:
+        test_prompt = st.text_input("Write your prompt here:", key="test_prompt_input")
+        if test_prompt:
+            st.session_state['test_prompt'] = test_prompt
+            st.session_state['test_prompt_submitted'] = True
+            record_progress(test_prompt=test_prompt)
+            rerun_step()
+    else:
+        st.text_input("Write your prompt here:", value=st.session_state['test_prompt'], disabled=True)
+
+    if st.session_state['test_prompt_submitted']:
+        step_test_image()
+
+# Generate and display the image of the test prompt
+@study_step
+def step_test_image():
+    # A session resumed without its image (bytes in b64_json mode, or an expired OpenAI URL) keeps the archived image instead of a new one
+    if not st.session_state['display_test_image'] and not st.session_state['test_image_url']:
+        with st.spinner('Generating your image...'):
+            test_image_upload, display_test_image = generate_test_image(st.session_state['test_prompt'], st.session_state['prolific_id'])
+            if display_test_image:
+                st.session_state['test_image_upload'] = test_image_upload
+                st.session_state['display_test_image'] = display_test_image
+                st.session_state['display_test_image_at'] = time.time()
+                record_archived_link(test_image_upload, st.session_state['prolific_id'], 'test_image_url')
+                save_snapshot()
+
+    # Display generated image result
+    if st.session_state['display_test_image']:
+        try:
+            st.image(st.session_state['display_test_image'], caption=f"Generated Image based on: {st.session_state['test_prompt']}", use_container_width=True)
+        except Exception as e:
+            st.error(f"Error displaying the image: {str(e)}")
+    elif st.session_state['test_image_url']:
+        st.write(f"Your generated image: {st.session_state['test_image_url']}")
+
+    step_additional_rating()
+
+# Step 11: Ask for user feedback
+@study_step
+def step_additional_rating():
+    additional_rating_options = [1, 2, 3, 4, 5, 6, 7]
+    additional_rating_disabled = st.session_state["additional_feedback_given"]
+    additional_rating = st.radio(
+        "How satisfied are you with the generated image? (1 being the lowest and 7 being the highest)",
+        options=additional_rating_options,
+        index=None,
+        disabled=additional_rating_disabled,
+        key="additional_rating_radio"
+    )
+
+    if additional_rating is not None and not additional_rating_disabled:
+        st.session_state["additional_rating"] = additional_rating
+        st.session_state["additional_feedback_given"] = True
+        record_progress(additional_rating=additional_rating)
+        st.write(f"Thank you for your feedback! You rated your satisfaction as: {additional_rating}/7")
+        rerun_step()
+
+    if st.session_state["additional_feedback_given"]:
+        # # Step 12: Provide random code to proceed
+        # if not st.session_state['random_code']:
+        #     st.session_state['random_code'] = generate_unique_random_code()
+        #     record_progress(random_code=st.session_state['random_code'])
+
+        # st.write(f"Here is your code to proceed: **{st.session_state['random_code']}**")
+
+        step_save()
+
+# Step 13: Add "Save and Get Code" button
+@study_step
+def step_save():
+    if not st.session_state['save_button_clicked']:
+        if st.button("Save and Receive Code"):
+            with st.spinner('Saving your images...'):
+                collect_archived_links()
+                reconcile_archived_links()
+
+            # Gather all the data
+            data = {
+                'prolific_id': st.session_state.get('prolific_id', ''),
+                'analysis_mode': ANALYSIS_MODE,
+                # The combined call was unusable and this session got the sequential two-call analysis
+                'analysis_fallback': st.session_state.get('analysis_fallback', False),
+                'user_prompt': st.session_state.get('user_prompt', ''),
+                'bias_example': st.session_state.get('bias_example', ''),
+                'inclusive_suggestion': st.session_state.get('inclusive_suggestion', ''),
+                'final_prompt': st.session_state.get('final_prompt', ''),
+                'image_url': st.session_state.get('image_url') or display_link('display_prompt_image'),
+                'rating': st.session_state.get('rating'),
+                'speculative_outcome': st.session_state.get('speculative_outcome'),
+                'additional_feedback': st.session_state.get('additional_feedback',''),
+                'random_profession': st.session_state.get('random_object', ''),
+                'random_profession_category': st.session_state.get('random_object_category', ''),
+                'test_prompt': st.session_state.get('test_prompt', ''),
+                'test_image_url': st.session_state.get('test_image_url') or display_link('display_test_image'),
+                'images_archived': bool(st.session_state.get('image_url') and st.session_state.get('test_image_url')),
+                'additional_rating': st.session_state.get('additional_rating')
+            }
+
+            # Mark the record as completed (duplicate Prolific IDs are rejected by the unique index)
+            if insert_user_data(data):
+                st.success("Data saved successfully!")
+                st.write("Here is your code to proceed.")
+                st.code("1001")
+                st.write("Please copy and paste this code into the text box in the questionnaire.")
+                st.session_state['save_button_clicked'] = True
+    else:
+        st.write("Data has already been saved. Your completion code is:")
+        st.code("1001")
+        st.write("Please copy and paste this code into the text box in the questionnaire.")
+
+# Tag every span of this run with the participant's session
+metrics.set_tags(session=st.session_state.get('prolific_id') or st.session_state['scheduler_session_id'], step=None)
+
+collect_archived_links()
+
+# Step 1: Introduce InclusiArt AI
+st.title("InclusiArt AI")
+st.write("""
+Welcome to InclusiArt AI! I am a text-to-image generative AI tool designed to help you bring your fantasy characters to life. Simply describe your character, and I'll generate an image based on your description.
+""")
+
+step_prolific_id()
 
-            if rating is not None and not rating_disabled:
-                st.session_state["rating"] = rating
-                st.session_state["feedback_given"] = True
-                st.write(f"Thank you for your feedback! You rated your satisfaction as: {rating}/7")
-                st.rerun()
-
-            if st.session_state["feedback_given"]:
-                # Step 9: Ask for additional feedback
-                if not st.session_state['additional_feedback_submitted']:
-                    additional_feedback = st.text_input("Any feedback about the inclusiveness of the AI-generated image?", key="additional_feedback_input")
-                    if additional_feedback:
-                        st.session_state['additional_feedback'] = additional_feedback
-                        st.session_state['additional_feedback_submitted'] = True
-                        st.rerun()
-                else:
-                    st.text_input("Any feedback about the inclusiveness of the AI-generated image?", value=st.session_state['additional_feedback'], disabled=True)
-
-                if st.session_state['additional_feedback_submitted']:
-                    # Step 10: Test user's understanding of inclusive prompting
-                    if not st.session_state['random_object']:
-                        st.session_state['random_object'] = get_random_object("")
-
-                    st.write(f"Now, to test your understanding of inclusive prompting, write an inclusive prompt to generate an image of: **{st.session_state['random_object']}**")
-
-                    if not st.session_state['test_prompt_submitted']:
-                        test_prompt = st.text_input("Write your prompt here:", key="test_prompt_input")
-                        if test_prompt:
-                            st.session_state['test_prompt'] = test_prompt
-                            st.session_state['test_prompt_submitted'] = True
-                            st.rerun()
-                    else:
-                        st.text_input("Write your prompt here:", value=st.session_state['test_prompt'], disabled=True)
-
-                    if st.session_state['test_prompt_submitted']:
-                        # Generate image based on test prompt
-                        if not st.session_state['test_image_url']:
-                            with st.spinner('Generating your image...'):
-                                test_image_url, display_test_image = generate_test_image(st.session_state['test_prompt'], st.session_state['prolific_id'])
-                                if test_image_url:
-                                    st.session_state['test_image_url'] = test_image_url
-                                    st.session_state['display_test_image'] = display_test_image
-
-                        # Display generated image result
-                        if st.session_state['test_image_url']:
-                            try:
-                                st.image(st.session_state['display_test_image'], caption=f"Generated Image based on: {st.session_state['test_prompt']}", use_container_width=True)
-                            except Exception as e:
-                                st.error(f"Error displaying the image: {str(e)}")
-
-                        # Step 11: Ask for user feedback
-                        additional_rating_options = [1, 2, 3, 4, 5, 6, 7]
-                        additional_rating_disabled = st.session_state["additional_feedback_given"]
-                        additional_rating = st.radio(
-                            "How satisfied are you with the generated image? (1 being the lowest and 7 being the highest)",
-                            options=additional_rating_options,
-                            index=None,
-                            disabled=additional_rating_disabled,
-                            key="additional_rating_radio"
-                        )
-
-                        if additional_rating is not None and not additional_rating_disabled:
-                            st.session_state["additional_rating"] = additional_rating
-                            st.session_state["additional_feedback_given"] = True
-                            st.write(f"Thank you for your feedback! You rated your satisfaction as: {additional_rating}/7")
-                            st.rerun()
-                        
-
-                        if st.session_state["additional_feedback_given"]:
-                            # # Step 12: Provide random code to proceed
-                            # if not st.session_state['random_code']:
-                            #     st.session_state['random_code'] = generate_unique_random_code()
-
-                            # st.write(f"Here is your code to proceed: **{st.session_state['random_code']}**")
-
-                            # Step 13: Add "Save and Get Code" button
-                            if not st.session_state['save_button_clicked']:
-                                if st.button("Save and Receive Code"):
-                                    # Gather all the data
-                                    data = {
-                                        'prolific_id': st.session_state.get('prolific_id', ''),
-                                        'user_prompt': st.session_state.get('user_prompt', ''),
-                                        'bias_example': st.session_state.get('bias_example', ''),
-                                        'inclusive_suggestion': st.session_state.get('inclusive_suggestion', ''),
-                                        'final_prompt': st.session_state.get('final_prompt', ''),
-                                        'image_url': st.session_state.get('image_url', ''),
-                                        'rating': st.session_state.get('rating'),
-                                        'additional_feedback': st.session_state.get('additional_feedback',''),
-                                        'random_profession': st.session_state.get('random_object', ''),
-                                        'test_prompt': st.session_state.get('test_prompt', ''),
-                                        'test_image_url': st.session_state.get('test_image_url', ''),
-                                        'additional_rating': st.session_state.get('additional_rating')
-                                    }
-                                    
-                                    # Check if Prolific ID already exists
-                                    if check_prolific_id_exists(data['prolific_id']):
-                                        st.error("Error: This Prolific ID has already been used.")
-                                    else:
-                                        # Insert data into the database
-                                        if insert_user_data(data):
-                                            st.success("Data saved successfully!")
-                                            st.write("Here is your code to proceed.")
-                                            st.code("1001")
-                                            st.write("Please copy and paste this code into the text box in the questionnaire.")
-                                            st.session_state['save_button_clicked'] = True
-                                        else:
-                                            st.error("Error: Failed to save data. Please try again.")
-                            else:
-                                st.write("Data has already been saved. Your completion code is:")
-                                st.code("1001")
-                                st.write("Please copy and paste this code into the text box in the questionnaire.")
\ No newline at end of file
+start_warm_up()
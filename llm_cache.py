@@ -0,0 +1,93 @@
+import hashlib
+import json
+import sqlite3
+import sys
+import threading
+import time
+
+# Normalize a participant's prompt so near-identical inputs (case, spacing, trailing punctuation) share a cache entry
+def normalize_prompt(text):
+    return " ".join(text.lower().split()).rstrip(".!? ")
+
+# Content-addressed key over everything that determines the response
+def make_cache_key(model, messages, temperature, **params):
+    parts = [model, temperature, sorted(params.items())]
+    parts += [[message['role'], message['content']] for message in messages]
+    return hashlib.sha256(json.dumps(parts).encode('utf-8')).hexdigest()
+
+# Key of the request build_request(user_prompt, *args) sends, built with the participant's prompt normalized;
+# the prompt template around it is hashed as is
+def prompt_cache_key(build_request, user_prompt, *args):
+    return make_cache_key(**build_request(normalize_prompt(user_prompt), *args))
+
+# SQLite-backed response cache shared by every session and server process using the same file.
+# Entries expire after ttl_seconds and the least recently used ones are evicted beyond max_entries.
+class LLMResponseCache:
+    def __init__(self, path="llm_cache.db", ttl_seconds=7 * 24 * 3600, max_entries=50000, evict_every=100):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.evict_every = evict_every
+        self._local = threading.local()
+        self._puts = 0
+        with self._connection() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS responses
+                            (key TEXT PRIMARY KEY, response TEXT, latency REAL, created_at REAL, last_access REAL)""")
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+            conn.execute("CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value REAL)")
+            conn.executemany("INSERT OR IGNORE INTO stats VALUES (?, 0)", [('hits',), ('misses',), ('saved_seconds',)])
+
+    # sqlite3 connections cannot be shared between threads, so each thread opens its own
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        now = time.time()
+        with self._connection() as conn:
+            row = conn.execute("SELECT response, latency FROM responses WHERE key = ? AND created_at >= ?",
+                               (key, now - self.ttl_seconds)).fetchone()
+            if row is None:
+                conn.execute("UPDATE stats SET value = value + 1 WHERE name = 'misses'")
+                return None
+            conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            conn.execute("UPDATE stats SET value = value + 1 WHERE name = 'hits'")
+            conn.execute("UPDATE stats SET value = value + ? WHERE name = 'saved_seconds'", (row[1],))
+        return row[0]
+
+    # latency is the time the uncached call took, credited as saved on every later hit
+    def put(self, key, response, latency):
+        now = time.time()
+        with self._connection() as conn:
+            conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)", (key, response, latency, now, now))
+        self._puts += 1
+        if self._puts % self.evict_every == 0:
+            self.evict()
+
+    def evict(self):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+            conn.execute("""DELETE FROM responses WHERE key NOT IN
+                            (SELECT key FROM responses ORDER BY last_access DESC LIMIT ?)""", (self.max_entries,))
+
+    def stats(self):
+        with self._connection() as conn:
+            values = dict(conn.execute("SELECT name, value FROM stats").fetchall())
+            entries = conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        lookups = values['hits'] + values['misses']
+        return {
+            'entries': entries,
+            'hits': int(values['hits']),
+            'misses': int(values['misses']),
+            'hit_rate': values['hits'] / lookups if lookups else 0.0,
+            'saved_seconds': values['saved_seconds'],
+        }
+
+# Print the hit rate and saved latency of a cache file: python llm_cache.py [llm_cache.db]
+if __name__ == "__main__":
+    print(json.dumps(LLMResponseCache(*sys.argv[1:2]).stats(), indent=2))
@@ -0,0 +1,279 @@
+import atexit
+import functools
+import inspect
+import math
+import os
+import socket
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# Histogram bucket upper bounds in seconds (shared by every process so snapshots can be merged)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, math.inf)
+RECENT_WINDOW_SECONDS = 300
+PROCESS_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+_thread_local = threading.local()
+
+# Default tags (session, step) for spans recorded on the current thread
+def current_tags():
+    return dict(getattr(_thread_local, 'tags', {}))
+
+def set_tags(**tags):
+    _thread_local.tags = {**current_tags(), **tags}
+
+@contextmanager
+def tags(**tags):
+    previous = current_tags()
+    set_tags(**tags)
+    try:
+        yield
+    finally:
+        _thread_local.tags = previous
+
+# Decorator tagging every span recorded during the call with the given step
+def step(name):
+    def decorator(function):
+        if inspect.isgeneratorfunction(function):
+            @functools.wraps(function)
+            def generator_wrapper(*args, **kwargs):
+                with tags(step=name):
+                    yield from function(*args, **kwargs)
+            return generator_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with tags(step=name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# Wrap a function to run with the current thread's tags, e.g. before handing it to a background executor
+def with_current_tags(function):
+    captured = current_tags()
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with tags(**captured):
+            return function(*args, **kwargs)
+    return wrapper
+
+class Histogram:
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+        self.errors = 0
+
+    def observe(self, duration, error):
+        self.buckets[next(i for i, bound in enumerate(BUCKETS) if duration <= bound)] += 1
+        self.sum += duration
+        self.count += 1
+        self.errors += int(error)
+
+# Estimate a quantile from bucket counts by linear interpolation inside the bucket
+def percentile(buckets, q):
+    total = sum(buckets)
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    for i, count in enumerate(buckets):
+        if seen + count >= rank and count:
+            lower = BUCKETS[i - 1] if i else 0.0
+            upper = BUCKETS[i] if BUCKETS[i] != math.inf else lower * 2
+            return lower + (upper - lower) * (rank - seen) / count
+        seen += count
+    return BUCKETS[-2]
+
+# In-process span and event aggregation: latency histograms per (operation, step), event counters,
+# running totals of quantities such as bytes, sliding windows of recent spans (for throughput and
+# error rates) and of recent events, and the slowest recent spans
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = datetime.now(timezone.utc)
+        self.histograms = {}
+        self.counters = {}
+        self.totals = {}
+        self.recent = deque()
+        self.slowest = []
+
+    def observe(self, operation, duration, error=False, session=None, step=None):
+        now = time.time()
+        with self._lock:
+            self.histograms.setdefault((operation, step or ""), Histogram()).observe(duration, error)
+            self.recent.append((now, 'span', operation, error))
+            self._trim(now)
+            self.slowest.append({'operation': operation, 'step': step, 'session': session,
+                                 'seconds': round(duration, 3), 'error': error, 'at': now})
+            self.slowest = sorted(self.slowest, key=lambda s: s['seconds'], reverse=True)[:20]
+
+    # An event, e.g. a session started or a cache hit; kept apart from the spans' throughput and error rates
+    def count(self, name):
+        now = time.time()
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+            self.recent.append((now, 'event', name, False))
+            self._trim(now)
+
+    # A quantity, e.g. bytes stored, exported as its own counter rather than as a number of events
+    def add(self, name, value):
+        with self._lock:
+            self.totals[name] = self.totals.get(name, 0) + value
+
+    def _trim(self, now):
+        while self.recent and self.recent[0][0] < now - RECENT_WINDOW_SECONDS:
+            self.recent.popleft()
+
+    @contextmanager
+    def span(self, operation, **span_tags):
+        span_tags = {**current_tags(), **span_tags}
+        start = time.perf_counter()
+        error = False
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.observe(operation, time.perf_counter() - start, error, span_tags.get('session'), span_tags.get('step'))
+
+    def snapshot(self):
+        with self._lock:
+            self._trim(time.time())
+            recent = {}
+            recent_events = {}
+            for _, kind, name, error in self.recent:
+                if kind == 'event':
+                    recent_events[name] = recent_events.get(name, 0) + 1
+                    continue
+                entry = recent.setdefault(name, {'count': 0, 'errors': 0})
+                entry['count'] += 1
+                entry['errors'] += int(error)
+            return {
+                'process': PROCESS_ID,
+                'started_at': self.started_at,
+                'updated_at': datetime.now(timezone.utc),
+                'window_seconds': RECENT_WINDOW_SECONDS,
+                'histograms': [{'operation': operation, 'step': step, 'buckets': list(h.buckets),
+                                'sum': h.sum, 'count': h.count, 'errors': h.errors}
+                               for (operation, step), h in self.histograms.items()],
+                'counters': dict(self.counters),
+                'totals': dict(self.totals),
+                'recent': recent,
+                'recent_events': recent_events,
+                'slowest': list(self.slowest),
+            }
+
+# Combine snapshots of several processes into one
+def merge_snapshots(snapshots):
+    histograms = {}
+    counters = {}
+    totals = {}
+    recent = {}
+    recent_events = {}
+    slowest = []
+    for snapshot in snapshots:
+        for h in snapshot['histograms']:
+            merged = histograms.setdefault((h['operation'], h['step']), {'operation': h['operation'], 'step': h['step'],
+                                                                         'buckets': [0] * len(BUCKETS), 'sum': 0.0, 'count': 0, 'errors': 0})
+            merged['buckets'] = [a + b for a, b in zip(merged['buckets'], h['buckets'])]
+            for key in ('sum', 'count', 'errors'):
+                merged[key] += h[key]
+        for name, value in snapshot['counters'].items():
+            counters[name] = counters.get(name, 0) + value
+        for name, value in snapshot.get('totals', {}).items():
+            totals[name] = totals.get(name, 0) + value
+        for name, value in snapshot.get('recent_events', {}).items():
+            recent_events[name] = recent_events.get(name, 0) + value
+        for name, entry in snapshot['recent'].items():
+            merged = recent.setdefault(name, {'count': 0, 'errors': 0})
+            merged['count'] += entry['count']
+            merged['errors'] += entry['errors']
+        slowest += snapshot['slowest']
+    return {
+        'histograms': list(histograms.values()),
+        'counters': counters,
+        'totals': totals,
+        'recent': recent,
+        'recent_events': recent_events,
+        'slowest': sorted(slowest, key=lambda s: s['seconds'], reverse=True)[:20],
+    }
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+# Every series carries the process label, so the files of several processes can be collected side by side
+def prometheus_text(snapshot):
+    process = f'process="{_label(snapshot.get("process", PROCESS_ID))}"'
+    lines = ["# TYPE inclusiart_operation_seconds histogram"]
+    for h in snapshot['histograms']:
+        labels = f'{process},operation="{_label(h["operation"])}",step="{_label(h["step"])}"'
+        cumulative = 0
+        for bound, count in zip(BUCKETS, h['buckets']):
+            cumulative += count
+            le = "+Inf" if bound == math.inf else repr(bound)
+            lines.append(f'inclusiart_operation_seconds_bucket{{{labels},le="{le}"}} {cumulative}')
+        lines.append(f"inclusiart_operation_seconds_sum{{{labels}}} {h['sum']}")
+        lines.append(f"inclusiart_operation_seconds_count{{{labels}}} {h['count']}")
+    lines.append("# TYPE inclusiart_operation_errors_total counter")
+    for h in snapshot['histograms']:
+        lines.append(f'inclusiart_operation_errors_total{{{process},operation="{_label(h["operation"])}",step="{_label(h["step"])}"}} {h["errors"]}')
+    lines.append("# TYPE inclusiart_events_total counter")
+    for name, value in snapshot['counters'].items():
+        lines.append(f'inclusiart_events_total{{{process},name="{_label(name)}"}} {value}')
+    for name, value in snapshot.get('totals', {}).items():
+        lines.append(f"# TYPE inclusiart_{name}_total counter")
+        lines.append(f'inclusiart_{name}_total{{{process}}} {value}')
+    return "\n".join(lines) + "\n"
+
+# This process's own Prometheus file next to the configured path (metrics.prom -> metrics.<host>-<pid>.prom),
+# so several app processes or replicas writing to one textfile-collector directory do not overwrite each other
+def process_prometheus_path(path):
+    root, extension = os.path.splitext(path)
+    return f"{root}.{PROCESS_ID.replace(':', '-')}{extension or '.prom'}"
+
+# Periodically write this process's snapshot to a MongoDB collection and/or a Prometheus text file
+def start_exporter(collection=None, prometheus_path=None, interval=10):
+    stopped = threading.Event()
+    write_lock = threading.Lock()
+
+    # A stopped process's series should not be collected forever, so its file is removed at exit
+    def remove_prometheus_file():
+        with write_lock:
+            stopped.set()
+            if os.path.exists(prometheus_path):
+                os.remove(prometheus_path)
+
+    if prometheus_path:
+        prometheus_path = process_prometheus_path(prometheus_path)
+        atexit.register(remove_prometheus_file)
+
+    def export():
+        while not stopped.wait(interval):
+            snapshot = registry.snapshot()
+            try:
+                if collection is not None:
+                    collection.replace_one({'_id': PROCESS_ID}, snapshot, upsert=True)
+                if prometheus_path:
+                    with write_lock:
+                        if stopped.is_set():
+                            return
+                        tmp_path = f"{prometheus_path}.tmp"
+                        with open(tmp_path, 'w') as f:
+                            f.write(prometheus_text(snapshot))
+                        os.replace(tmp_path, prometheus_path)
+            except Exception as e:
+                print(f"Metrics export failed: {e}")
+
+    thread = threading.Thread(target=export, daemon=True, name="metrics-exporter")
+    thread.start()
+    return thread
+
+registry = MetricsRegistry()
+span = registry.span
+count = registry.count
+add = registry.add
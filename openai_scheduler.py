@@ -0,0 +1,225 @@
+import random
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+import openai
+
+DEFAULT_LIMITS = {
+    "chat": {"requests_per_minute": 500, "max_concurrency": 50},
+    "images": {"requests_per_minute": 50, "max_concurrency": 10},
+}
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError, openai.InternalServerError)
+
+# Parse OpenAI reset durations such as "20ms", "1s" or "6m0s" into seconds
+def parse_duration(value):
+    units = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+    return sum(float(amount) * units[unit] for amount, unit in re.findall(r'([\d.]+)(ms|h|m|s)', value or ''))
+
+class TokenBucket:
+    def __init__(self, requests_per_minute, capacity=None):
+        self.rate = requests_per_minute / 60.0
+        self.capacity = capacity or max(1.0, requests_per_minute / 6.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self, now):
+        self.refill(now)
+        if now < self.paused_until or self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    # Seconds until the n-th next token is available
+    def wait_time(self, now, n=1):
+        self.refill(now)
+        return max(self.paused_until - now, (n - self.tokens) / self.rate, 0.0)
+
+    # Stop handing out tokens, e.g. when the API reports the rate limit is exhausted
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+
+# Waiting requests of one endpoint. Sessions are served round-robin, so a session with several
+# queued requests cannot starve the others.
+class EndpointQueue:
+    def __init__(self, requests_per_minute, max_concurrency):
+        self.bucket = TokenBucket(requests_per_minute)
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.average_latency = 1.0
+        self.waiting = OrderedDict()
+
+    def add(self, session_id, ticket):
+        self.waiting.setdefault(session_id, deque()).append(ticket)
+
+    def remove(self, session_id, ticket):
+        tickets = self.waiting.get(session_id)
+        if tickets and ticket in tickets:
+            tickets.remove(ticket)
+            if not tickets:
+                del self.waiting[session_id]
+
+    def is_next(self, ticket):
+        return bool(self.waiting) and next(iter(self.waiting.values()))[0] is ticket
+
+    def pop_next(self):
+        session_id, tickets = next(iter(self.waiting.items()))
+        tickets.popleft()
+        if tickets:
+            self.waiting.move_to_end(session_id)
+        else:
+            del self.waiting[session_id]
+
+    # 1-based position of a ticket in round-robin service order
+    def position(self, session_id, ticket):
+        index = self.waiting[session_id].index(ticket)
+        ahead = index
+        before = True
+        for other_id, tickets in self.waiting.items():
+            if other_id == session_id:
+                before = False
+                continue
+            ahead += min(len(tickets), index + 1 if before else index)
+        return ahead + 1
+
+    def eta(self, position, now):
+        return max(self.bucket.wait_time(now, position), position * self.average_latency / self.max_concurrency)
+
+# A streamed response that holds its endpoint's concurrency slot until it has been read to the end (or closed).
+# The first chunk is read when the request is sent, so a stream failing before any output is retried like a request.
+class ScheduledStream:
+    _END = object()
+
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._iterator = iter(stream)
+        self._release = release
+        self._released = False
+        try:
+            self._first = next(self._iterator, self._END)
+        except BaseException:
+            # The caller releases the slot of a request that failed
+            self._released = True
+            self._close_stream()
+            raise
+
+    def __iter__(self):
+        try:
+            if self._first is not self._END:
+                yield self._first
+            yield from self._iterator
+        finally:
+            self.close()
+
+    def _close_stream(self):
+        if hasattr(self._stream, "close"):
+            self._stream.close()
+
+    def close(self):
+        if not self._released:
+            self._released = True
+            self._close_stream()
+            self._release()
+
+    def __del__(self):
+        self.close()
+
+# Shared gate in front of all OpenAI calls: a token bucket and concurrency limit per endpoint,
+# fair per-session queueing, rate-limit header tracking and jittered exponential backoff.
+class OpenAIScheduler:
+    def __init__(self, limits=None, max_retries=5, base_delay=1.0, max_delay=30.0):
+        # Settings given for an endpoint override its defaults one by one
+        limits = {**DEFAULT_LIMITS, **(limits or {})}
+        self.queues = {endpoint: EndpointQueue(**{**DEFAULT_LIMITS.get(endpoint, {}), **config}) for endpoint, config in limits.items()}
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._cond = threading.Condition()
+
+    # Block until the request may be sent. on_wait(position, eta_seconds) is called periodically while queued.
+    def acquire(self, endpoint, session_id, on_wait=None):
+        queue = self.queues[endpoint]
+        ticket = object()
+        with self._cond:
+            queue.add(session_id, ticket)
+        try:
+            while True:
+                with self._cond:
+                    now = time.monotonic()
+                    if queue.is_next(ticket) and queue.in_flight < queue.max_concurrency and queue.bucket.try_take(now):
+                        queue.pop_next()
+                        queue.in_flight += 1
+                        self._cond.notify_all()
+                        return
+                    position = queue.position(session_id, ticket)
+                    eta = queue.eta(position, now)
+                    self._cond.wait(timeout=min(0.5, max(queue.bucket.wait_time(now), 0.01)))
+                if on_wait is not None:
+                    on_wait(position, eta)
+        except BaseException:
+            with self._cond:
+                queue.remove(session_id, ticket)
+                self._cond.notify_all()
+            raise
+
+    def release(self, endpoint, latency):
+        queue = self.queues[endpoint]
+        with self._cond:
+            queue.in_flight -= 1
+            queue.average_latency = 0.8 * queue.average_latency + 0.2 * latency
+            self._cond.notify_all()
+
+    # Pause the endpoint until the reset time when the API reports no requests or tokens left
+    def update_from_headers(self, endpoint, headers):
+        for kind in ("requests", "tokens"):
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+            if remaining is not None and remaining.isdigit() and int(remaining) == 0:
+                with self._cond:
+                    self.queues[endpoint].bucket.pause(parse_duration(headers.get(f"x-ratelimit-reset-{kind}")))
+
+    # Server hints are capped at max_delay too, since the whole endpoint is paused for the delay
+    def retry_delay(self, attempt, headers):
+        if headers.get("retry-after-ms"):
+            return min(self.max_delay, float(headers["retry-after-ms"]) / 1000)
+        if headers.get("retry-after", "").replace('.', '', 1).isdigit():
+            return min(self.max_delay, float(headers["retry-after"]))
+        return min(self.max_delay, self.base_delay * 2 ** attempt) * random.uniform(0.5, 1.5)
+
+    # Send a request created with the client's with_raw_response API and return the parsed response.
+    # A streamed response (stream=True) keeps its concurrency slot until it has been read.
+    def call(self, endpoint, session_id, create, on_wait=None, **request):
+        attempt = 0
+        while True:
+            self.acquire(endpoint, session_id, on_wait)
+            start = time.monotonic()
+            try:
+                raw = create(**request)
+                if request.get("stream"):
+                    stream = ScheduledStream(raw.parse(), lambda: self.release(endpoint, time.monotonic() - start))
+            except RETRYABLE_ERRORS as e:
+                self.release(endpoint, time.monotonic() - start)
+                response = getattr(e, 'response', None)
+                headers = response.headers if response is not None else {}
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.retry_delay(attempt, headers)
+                if isinstance(e, openai.RateLimitError):
+                    with self._cond:
+                        self.queues[endpoint].bucket.pause(delay)
+                time.sleep(delay)
+                attempt += 1
+                continue
+            except BaseException:
+                self.release(endpoint, time.monotonic() - start)
+                raise
+            self.update_from_headers(endpoint, raw.headers)
+            if request.get("stream"):
+                return stream
+            self.release(endpoint, time.monotonic() - start)
+            return raw.parse()
@@ -0,0 +1,57 @@
+import random
+import threading
+from collections import deque
+
+# Categories used for the test profession in Step 10, with seed examples so the pool is usable before the first refill
+PROFESSION_CATEGORIES = {
+    "Service workers": ["waiter", "cashier", "receptionist"],
+    "Office workers": ["accountant", "secretary"],
+    "Healthcare workers": ["nurse", "doctor"],
+    "Education": ["teacher", "professor"],
+    "Trade workers": ["plumber", "electrician"],
+    "Business professionals": ["manager", "salesperson"],
+}
+
+# Pool of test professions shared by all sessions of a server process.
+# Picking is a local operation; categories are assigned round-robin by fewest assignments so the
+# test condition stays counterbalanced, and a category is refilled in the background when it runs low.
+class ProfessionPool:
+    def __init__(self, generate_batch, categories=PROFESSION_CATEGORIES, assigned_counts=None, low_watermark=5):
+        # generate_batch(category, examples) returns a list of profession names for that category
+        self.generate_batch = generate_batch
+        self.categories = categories
+        self.low_watermark = low_watermark
+        self._lock = threading.Lock()
+        self._pools = {category: deque(random.sample(examples, len(examples))) for category, examples in categories.items()}
+        self._assigned = {category: (assigned_counts or {}).get(category, 0) for category in categories}
+        self._refilling = set()
+        for category in categories:
+            self._start_refill(category)
+
+    def pick(self):
+        with self._lock:
+            fewest = min(self._assigned.values())
+            category = random.choice([c for c, count in self._assigned.items() if count == fewest])
+            pool = self._pools[category]
+            profession = pool.popleft() if pool else random.choice(self.categories[category])
+            self._assigned[category] += 1
+            running_low = len(pool) < self.low_watermark
+        if running_low:
+            self._start_refill(category)
+        return category, profession
+
+    def _start_refill(self, category):
+        with self._lock:
+            if category in self._refilling:
+                return
+            self._refilling.add(category)
+        threading.Thread(target=self._refill, args=(category,), daemon=True).start()
+
+    def _refill(self, category):
+        try:
+            professions = self.generate_batch(category, self.categories[category])
+        except Exception:
+            professions = []
+        with self._lock:
+            self._pools[category].extend(p for p in professions if p)
+            self._refilling.discard(category)
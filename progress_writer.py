@@ -0,0 +1,60 @@
+import atexit
+import threading
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+from pymongo.write_concern import WriteConcern
+import metrics
+
+# Buffers per-participant field updates and upserts them in batches with a single unordered bulk_write.
+# Updates for the same participant are coalesced, so a batch holds at most one operation per participant.
+class ProgressWriter:
+    def __init__(self, collection, key_field="prolific_id", on_insert=None, batch_size=100, flush_interval=1.0, write_concern=None):
+        if write_concern:
+            collection = collection.with_options(write_concern=WriteConcern(**write_concern))
+        self.collection = collection
+        self.key_field = key_field
+        self.on_insert = on_insert or {}
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        threading.Thread(target=self._run, daemon=True, name="progress-writer").start()
+        atexit.register(self.flush)
+
+    def update(self, key, fields):
+        with self._lock:
+            self._pending.setdefault(key, {}).update(fields)
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self._wakeup.set()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return
+            operations = [UpdateOne({self.key_field: key}, self._update_document(fields), upsert=True) for key, fields in pending.items()]
+            try:
+                with metrics.span("mongo_bulk_write", step=self.collection.name):
+                    self.collection.bulk_write(operations, ordered=False)
+            except PyMongoError as e:
+                # The updates are idempotent, so put the batch back (behind any newer values) and retry on the next flush
+                print(f"Progress write failed, retrying: {e}")
+                with self._lock:
+                    for key, fields in pending.items():
+                        self._pending[key] = {**fields, **self._pending.get(key, {})}
+
+    def _update_document(self, fields):
+        update = {"$set": fields}
+        if self.on_insert:
+            update["$setOnInsert"] = self.on_insert
+        return update
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
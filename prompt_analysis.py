@@ -0,0 +1,254 @@
+import json
+import re
+import time
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from llm_cache import LLMResponseCache, prompt_cache_key
+import metrics
+
+# Bias analysis and inclusive rewrites of character descriptions, shared by the study app (inclusiart.py)
+# and the headless batch runner (batch_analysis.py). Settings are read from .streamlit/secrets.toml either way.
+
+# Initialize OpenAI client with API key (retries are handled by the shared scheduler below);
+# openai_base_url points the app at another endpoint, e.g. the local stub in benchmarks/fake_openai.py
+@st.cache_resource(show_spinner=False)
+def get_openai_client():
+    from openai import OpenAI
+    return OpenAI(api_key=st.secrets["OPENAI_API_KEY"], base_url=st.secrets.get("openai_base_url"), max_retries=0)
+
+# One scheduler per server process in front of all OpenAI calls; per-endpoint limits can be set in the
+# openai_limits section of secrets.toml, e.g. [openai_limits.images] requests_per_minute = 15, max_concurrency = 5
+@st.cache_resource(show_spinner=False)
+def get_openai_scheduler():
+    from openai_scheduler import OpenAIScheduler
+    return OpenAIScheduler(st.secrets.get("openai_limits", {}))
+
+# Send an OpenAI request through the scheduler. On the script thread the participant's session is queued
+# fairly against the others and sees its queue position; background jobs share one "background" queue slot.
+def run_openai_request(endpoint, create, **request):
+    def timed_create(**request):
+        with metrics.span(f"openai_{endpoint}"):
+            return create(**request)
+
+    with metrics.span(f"openai_{endpoint}_with_queue"):
+        return schedule_openai_request(endpoint, timed_create, **request)
+
+def schedule_openai_request(endpoint, create, **request):
+    if get_script_run_ctx(suppress_warning=True) is None:
+        return get_openai_scheduler().call(endpoint, "background", create, **request)
+    status = {}
+
+    def on_wait(position, eta):
+        if 'placeholder' not in status:
+            status['placeholder'] = st.empty()
+        status['placeholder'].info(f"Many participants are using InclusiArt AI right now. You are number {position} in the queue (about {max(1, round(eta))} seconds).")
+
+    try:
+        return get_openai_scheduler().call(endpoint, st.session_state['scheduler_session_id'], create, on_wait=on_wait, **request)
+    finally:
+        if 'placeholder' in status:
+            status['placeholder'].empty()
+
+# Study condition: "combined" streams bias analysis and rewrite from one structured call,
+# "sequential" keeps the original two-call path (get_bias_example, then suggest_inclusive_prompt)
+ANALYSIS_MODE = st.secrets.get("analysis_mode", "combined")
+# Shared cache of bias analyses and rewrites; list analysis modes that need fresh sampling in disabled_conditions
+LLM_CACHE_CONFIG = st.secrets.get("llm_cache", {})
+LLM_CACHE_ENABLED = LLM_CACHE_CONFIG.get("enabled", True) and ANALYSIS_MODE not in LLM_CACHE_CONFIG.get("disabled_conditions", [])
+
+@st.cache_resource(show_spinner=False)
+def get_llm_cache():
+    return LLMResponseCache(
+        path=LLM_CACHE_CONFIG.get("path", "llm_cache.db"),
+        ttl_seconds=LLM_CACHE_CONFIG.get("ttl_seconds", 7 * 24 * 3600),
+        max_entries=LLM_CACHE_CONFIG.get("max_entries", 50000)
+    )
+
+# Look up the request build_request(user_prompt, *args) in the response cache; returns (cache, key, cached response)
+def lookup_llm_cache(build_request, user_prompt, *args):
+    if not LLM_CACHE_ENABLED:
+        return None, None, None
+    cache = get_llm_cache()
+    key = prompt_cache_key(build_request, user_prompt, *args)
+    cached = cache.get(key)
+    metrics.count("llm_cache_hit" if cached is not None else "llm_cache_miss")
+    return cache, key, cached
+
+# Chat completion that is served from the response cache when an equivalent request has been answered before
+def cached_chat_completion(build_request, user_prompt, *args):
+    cache, key, cached = lookup_llm_cache(build_request, user_prompt, *args)
+    if cached is not None:
+        return cached
+    start = time.perf_counter()
+    response = run_openai_request("chat", get_openai_client().chat.completions.with_raw_response.create, **build_request(user_prompt, *args))
+    content = response.choices[0].message.content
+    if cache is not None:
+        cache.put(key, content, time.perf_counter() - start)
+    return content
+
+# Chat completion request of the bias analysis
+def bias_example_request(user_prompt):
+    return dict(
+        model="gpt-4o-mini",
+        messages=[
+            {"role": "system", "content": """You are an expert in identifying unconscious bias, stereotypes, and representation issues in character descriptions. Focus on detecting subtle biases related to:
+- Gender roles and expectations
+- Cultural and ethnic stereotypes
+- Physical appearance assumptions
+- Age-related prejudices
+- Socioeconomic stereotypes
+Provide specific, concrete examples of potential biases."""},
+            {"role": "user", "content": f"Analyze this character description: '{user_prompt}'. In one clear, specific sentence, identify the most significant potential bias or stereotype that could emerge in the visual representation."}
+        ],
+        max_tokens=100,
+        temperature=0.7
+    )
+
+# Function to get bias example from OpenAI using ChatCompletion API
+@metrics.step("bias_analysis")
+def get_bias_example(user_prompt):
+    return cached_chat_completion(bias_example_request, user_prompt)
+
+# Chat completion request of the inclusive rewrite
+def inclusive_prompt_request(user_prompt, bias_example):
+    return dict(
+        model="gpt-4o-mini",
+        messages=[
+            {"role": "system", "content": """You are an expert in rewriting character descriptions to be more inclusive. Your task is to:
+- Keep the exact same character concept
+- Remove potentially biased language
+Provide only the rewritten prompt without any explanation."""},
+            {"role": "user", "content": f"Rewrite this character description to be more inclusive while keeping the same core concept: '{user_prompt}'. Address this specific bias: '{bias_example}'. Dont print text like 'Rewrite:' before the description"}
+        ],
+        max_tokens=100,
+        temperature=0.7
+    )
+
+# Function to provide more inclusive alternatives for the user's prompt
+@metrics.step("inclusive_rewrite")
+def suggest_inclusive_prompt(user_prompt,bias_example):
+    return cached_chat_completion(inclusive_prompt_request, user_prompt, bias_example)
+
+# Structured output schema for the combined bias analysis and inclusive rewrite
+PROMPT_COACHING_SCHEMA = {
+    "name": "prompt_coaching",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "bias_example": {
+                "type": "string",
+                "description": "One clear, specific sentence identifying the most significant potential bias or stereotype that could emerge in the visual representation."
+            },
+            "inclusive_suggestion": {
+                "type": "string",
+                "description": "The rewritten, more inclusive character description, without any label or explanation."
+            }
+        },
+        "required": ["bias_example", "inclusive_suggestion"],
+        "additionalProperties": False
+    }
+}
+
+# Pull the (possibly unfinished) string fields out of a partially streamed JSON object
+def parse_partial_fields(buffer, fields):
+    values = {}
+    for field in fields:
+        match = re.search(r'"%s"\s*:\s*"((?:[^"\\]|\\.)*)' % field, buffer)
+        if not match:
+            continue
+        raw = match.group(1)
+        try:
+            values[field] = json.loads(f'"{raw}"')
+        except json.JSONDecodeError:
+            values[field] = raw
+    return values
+
+# Chat completion request of the combined bias analysis and rewrite (a structured, JSON response)
+def bias_and_suggestion_request(user_prompt):
+    return dict(
+        model="gpt-4o-mini",
+        messages=[
+            {"role": "system", "content": """You are an expert in identifying unconscious bias, stereotypes, and representation issues in character descriptions, and in rewriting them to be more inclusive. Focus on detecting subtle biases related to:
+- Gender roles and expectations
+- Cultural and ethnic stereotypes
+- Physical appearance assumptions
+- Age-related prejudices
+- Socioeconomic stereotypes
+When rewriting:
+- Keep the exact same character concept
+- Remove potentially biased language
+- Address the bias you identified"""},
+            {"role": "user", "content": f"Analyze this character description: '{user_prompt}'. First identify, in one clear, specific sentence, the most significant potential bias or stereotype that could emerge in the visual representation. Then rewrite the description to be more inclusive while keeping the same core concept. Dont print text like 'Rewrite:' before the description"}
+        ],
+        response_format={"type": "json_schema", "json_schema": PROMPT_COACHING_SCHEMA},
+        max_tokens=250,
+        temperature=0.7
+    )
+
+# The complete result of the combined call, or None if the reply is not a JSON object with both fields
+def parse_bias_and_suggestion(content):
+    try:
+        result = json.loads(content)
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(result, dict) or not all(isinstance(result.get(field), str) for field in ("bias_example", "inclusive_suggestion")):
+        return None
+    return result
+
+# Function to get the bias example and the inclusive rewrite from a single streamed, structured call
+# Yields partial results as tokens arrive; the last yielded dict is the complete result.
+# A reply cut off at max_tokens or by a failed connection, a refusal or malformed JSON falls back to the two-call
+# path (the scheduler retries a stream only until its first chunk, as the output already shown cannot be taken back),
+# and is not cached;
+# that result is marked with analysis_fallback, so the session can be told apart from the combined condition.
+@metrics.step("bias_analysis_and_rewrite")
+def stream_bias_and_suggestion(user_prompt):
+    request = bias_and_suggestion_request(user_prompt)
+    cache, key, cached = lookup_llm_cache(bias_and_suggestion_request, user_prompt)
+    if cached is not None:
+        yield json.loads(cached)
+        return
+    start = time.perf_counter()
+    stream = run_openai_request("chat", get_openai_client().chat.completions.with_raw_response.create, **request, stream=True)
+    buffer = ""
+    finish_reason = None
+    refused = False
+    try:
+        with metrics.span("openai_chat_stream"):
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                choice = chunk.choices[0]
+                finish_reason = choice.finish_reason or finish_reason
+                refused = refused or bool(choice.delta.refusal)
+                if not choice.delta.content:
+                    continue
+                buffer += choice.delta.content
+                yield parse_partial_fields(buffer, ("bias_example", "inclusive_suggestion"))
+    except Exception as e:
+        finish_reason = f"error: {e!r}"
+    result = None if refused or finish_reason != "stop" else parse_bias_and_suggestion(buffer)
+    if result is None:
+        print(f"Combined analysis unusable (finish_reason={finish_reason}, refused={refused}), falling back to two calls")
+        metrics.count("combined_analysis_fallback")
+        yield {**analyze_sequentially(user_prompt), 'analysis_fallback': True}
+        return
+    if cache is not None:
+        cache.put(key, buffer, time.perf_counter() - start)
+    yield result
+
+# Bias example, then the inclusive suggestion addressing it (the "sequential" condition)
+def analyze_sequentially(user_prompt):
+    bias_example = get_bias_example(user_prompt)
+    return {'bias_example': bias_example,
+            'inclusive_suggestion': suggest_inclusive_prompt(user_prompt, bias_example) if bias_example else ""}
+
+# Bias example and inclusive suggestion of a prompt in the given analysis mode, without streaming
+def analyze_prompt(user_prompt, mode=None):
+    if (mode or ANALYSIS_MODE) == "sequential":
+        return analyze_sequentially(user_prompt)
+    result = {}
+    for result in stream_bias_and_suggestion(user_prompt):
+        pass
+    return result
@@ -0,0 +1,68 @@
+import time
+from dataclasses import dataclass, fields
+from datetime import datetime, timezone
+
+# OpenAI image URLs expire an hour after generation; older display images are not restored (with some margin
+# for the page to load), so a resumed session shows the archived copy instead of a broken image
+DISPLAY_URL_TTL_SECONDS = 50 * 60
+DISPLAY_IMAGES = ('display_prompt_image', 'display_test_image')
+
+# Compact server-side record of a participant's progress, keyed by Prolific ID.
+# Only the generated artifacts and answers are stored; the step flags are derived from them on restore.
+@dataclass
+class SessionSnapshot:
+    prolific_id: str
+    user_prompt: str = ""
+    analysis_fallback: bool = False
+    bias_example: str = ""
+    inclusive_suggestion: str = ""
+    final_prompt: str = ""
+    display_prompt_image: str = ""
+    display_prompt_image_at: float = None
+    image_url: str = ""
+    speculative_outcome: str = ""
+    rating: int = None
+    additional_feedback: str = ""
+    random_object: str = ""
+    random_object_category: str = ""
+    test_prompt: str = ""
+    display_test_image: str = ""
+    display_test_image_at: float = None
+    test_image_url: str = ""
+    additional_rating: int = None
+
+    @classmethod
+    def from_session_state(cls, state):
+        return cls(**{field.name: state.get(field.name) or field.default for field in fields(cls)})
+
+    @classmethod
+    def from_document(cls, document):
+        names = {field.name for field in fields(cls)}
+        return cls(prolific_id=document['_id'], **{k: v for k, v in document.items() if k in names})
+
+    # Empty fields are left out to keep the stored document small, and so are display images held as
+    # bytes (b64_json mode): their archived copy is linked in image_url / test_image_url instead
+    def to_document(self):
+        document = {field.name: getattr(self, field.name) for field in fields(self)
+                    if field.name != 'prolific_id' and getattr(self, field.name) not in ("", None)
+                    and not isinstance(getattr(self, field.name), bytes)}
+        document['updated_at'] = datetime.now(timezone.utc)
+        return document
+
+    def expired_display_images(self, now=None):
+        now = now or time.time()
+        return {name for name in DISPLAY_IMAGES if (getattr(self, f"{name}_at") or 0) < now - DISPLAY_URL_TTL_SECONDS}
+
+    def apply_to(self, state):
+        expired = self.expired_display_images()
+        for field in fields(self):
+            value = getattr(self, field.name)
+            if value not in ("", None) and field.name not in expired:
+                state[field.name] = value
+        state['prolific_id_submitted'] = True
+        state['user_prompt_submitted'] = bool(self.user_prompt)
+        state['final_confirmed'] = bool(self.final_prompt)
+        state['feedback_given'] = self.rating is not None
+        state['additional_feedback_submitted'] = bool(self.additional_feedback)
+        state['test_prompt_submitted'] = bool(self.test_prompt)
+        state['additional_feedback_given'] = self.additional_rating is not None
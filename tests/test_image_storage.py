@@ -0,0 +1,78 @@
+import io
+import pytest
+import google_drive_utils
+from image_storage import LocalImageStore, sync_to_drive
+
+# Stands in for the Drive calls of sync_to_drive, failing the uploads and permission batches it is told to
+class FakeDrive:
+    def __init__(self, failing_names=(), failing_shares=0):
+        self.failing_names = set(failing_names)
+        self.failing_shares = failing_shares
+        self.uploaded = []
+        self.shared = []
+
+    def create_drive_file(self, image_file, filename, mimetype, folder_id=None):
+        if filename in self.failing_names:
+            raise OSError("upload failed")
+        self.uploaded.append(filename)
+        return {'id': f"id-{filename}", 'webViewLink': f"https://drive.example/{filename}"}
+
+    def share_files_publicly(self, file_ids):
+        if self.failing_shares:
+            self.failing_shares -= 1
+            raise OSError("permission batch failed")
+        self.shared.extend(file_ids)
+
+@pytest.fixture
+def use_drive(monkeypatch):
+    def install(drive, folder_is_public=False):
+        monkeypatch.setattr(google_drive_utils, "create_drive_file", drive.create_drive_file)
+        monkeypatch.setattr(google_drive_utils, "share_files_publicly", drive.share_files_publicly)
+        monkeypatch.setattr(google_drive_utils, "folder_is_public", lambda: folder_is_public)
+        return drive
+    return install
+
+def make_store(path, names):
+    store = LocalImageStore(str(path))
+    for name in names:
+        store.put(io.BytesIO(name.encode()), f"{name}.png", "image/png")
+    return store
+
+def test_identical_images_are_uploaded_once(tmp_path, use_drive):
+    drive = use_drive(FakeDrive())
+    store = make_store(tmp_path, ["a", "b"])
+    store.put(io.BytesIO(b"a"), "a-copy.png", "image/png")
+    assert sync_to_drive(store) == (2, [])
+    assert sorted(drive.uploaded) == ["a.png", "b.png"]
+    assert sorted(drive.shared) == ["id-a.png", "id-b.png"]
+
+def test_failed_uploads_are_collected_and_retried(tmp_path, use_drive):
+    use_drive(FakeDrive(failing_names={"b.png"}))
+    store = make_store(tmp_path, ["a", "b", "c"])
+    uploaded, failures = sync_to_drive(store, workers=2)
+    assert uploaded == 2
+    assert [name for name, _ in failures] == ["b.png"]
+
+    drive = use_drive(FakeDrive())
+    assert sync_to_drive(store) == (1, [])
+    assert drive.uploaded == ["b.png"]
+
+def test_unshared_files_are_shared_on_the_next_run(tmp_path, use_drive):
+    use_drive(FakeDrive(failing_shares=1))
+    store = make_store(tmp_path, ["a", "b"])
+    uploaded, failures = sync_to_drive(store)
+    assert uploaded == 2
+    assert sorted(name for name, _ in failures) == ["a.png", "b.png"]
+
+    drive = use_drive(FakeDrive())
+    assert sync_to_drive(store) == (0, [])
+    assert drive.uploaded == []
+    assert sorted(drive.shared) == ["id-a.png", "id-b.png"]
+    assert sync_to_drive(store) == (0, [])
+    assert sorted(drive.shared) == ["id-a.png", "id-b.png"]
+
+def test_public_folder_needs_no_permissions(tmp_path, use_drive):
+    drive = use_drive(FakeDrive(), folder_is_public=True)
+    store = make_store(tmp_path, ["a"])
+    assert sync_to_drive(store) == (1, [])
+    assert drive.shared == []
@@ -0,0 +1,72 @@
+import time
+import pytest
+from llm_cache import LLMResponseCache, make_cache_key, normalize_prompt, prompt_cache_key
+
+# Same shape as the app's request builders: the participant's prompt quoted inside a longer template
+def analysis_request(user_prompt):
+    return dict(
+        model="gpt-4o-mini",
+        messages=[
+            {"role": "system", "content": "You are an expert in identifying unconscious bias."},
+            {"role": "user", "content": f"Analyze this character description: '{user_prompt}'. In one clear, specific sentence, identify the most significant potential bias."}
+        ],
+        max_tokens=100,
+        temperature=0.7
+    )
+
+def rewrite_request(user_prompt, bias_example):
+    return dict(
+        model="gpt-4o-mini",
+        messages=[{"role": "user", "content": f"Rewrite '{user_prompt}' to address: '{bias_example}'."}],
+        max_tokens=100,
+        temperature=0.7
+    )
+
+@pytest.mark.parametrize("text", ["A brave knight", "A brave knight.", "a brave KNIGHT!", "  A  brave\tknight ?", "A brave knight..."])
+def test_normalize_prompt(text):
+    assert normalize_prompt(text) == "a brave knight"
+
+@pytest.mark.parametrize("variant", ["A brave knight.", "a brave knight", "A  brave knight!", " A brave knight "])
+def test_near_identical_prompts_share_a_key(variant):
+    assert prompt_cache_key(analysis_request, variant) == prompt_cache_key(analysis_request, "A brave knight")
+
+def test_different_prompts_get_different_keys():
+    assert prompt_cache_key(analysis_request, "A brave knight") != prompt_cache_key(analysis_request, "A brave wizard")
+
+def test_only_the_prompt_is_normalized():
+    # The other arguments, here the bias example, are part of the key as they are
+    assert prompt_cache_key(rewrite_request, "A brave knight.", "Gender") == prompt_cache_key(rewrite_request, "a brave knight", "Gender")
+    assert prompt_cache_key(rewrite_request, "A brave knight", "Gender") != prompt_cache_key(rewrite_request, "A brave knight", "gender")
+
+def test_key_covers_the_request_parameters():
+    request = analysis_request("A brave knight")
+    assert make_cache_key(**request) != make_cache_key(**{**request, "temperature": 0.2})
+    assert make_cache_key(**request) != make_cache_key(**{**request, "max_tokens": 250})
+    assert make_cache_key(**request) != make_cache_key(**{**request, "model": "gpt-4o"})
+
+def test_cache_round_trip_and_stats(tmp_path):
+    cache = LLMResponseCache(path=str(tmp_path / "cache.db"))
+    assert cache.get("key") is None
+    cache.put("key", "response", latency=1.5)
+    assert cache.get("key") == "response"
+    stats = cache.stats()
+    assert (stats['entries'], stats['hits'], stats['misses']) == (1, 1, 1)
+    assert stats['saved_seconds'] == pytest.approx(1.5)
+
+def test_expired_entries_are_missed(tmp_path):
+    cache = LLMResponseCache(path=str(tmp_path / "cache.db"), ttl_seconds=60)
+    cache.put("key", "response", latency=1.0)
+    with cache._connection() as conn:
+        conn.execute("UPDATE responses SET created_at = ?", (time.time() - 120,))
+    assert cache.get("key") is None
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = LLMResponseCache(path=str(tmp_path / "cache.db"), max_entries=2, evict_every=1000)
+    for key in ("a", "b", "c"):
+        cache.put(key, key, latency=0.1)
+        time.sleep(0.01)
+    cache.get("a")
+    cache.evict()
+    assert cache.get("a") == "a"
+    assert cache.get("c") == "c"
+    assert cache.get("b") is None
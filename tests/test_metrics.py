@@ -0,0 +1,42 @@
+import metrics
+
+def test_prometheus_file_is_per_process():
+    path = metrics.process_prometheus_path("/var/lib/node_exporter/inclusiart.prom")
+    assert path.startswith("/var/lib/node_exporter/inclusiart.")
+    assert path.endswith(".prom")
+    assert path != "/var/lib/node_exporter/inclusiart.prom"
+
+def test_prometheus_series_carry_the_process_label():
+    registry = metrics.MetricsRegistry()
+    with registry.span("mongo_find_snapshot", step="resume"):
+        pass
+    registry.count("sessions_started")
+    text = metrics.prometheus_text(registry.snapshot())
+    series = [line for line in text.splitlines() if not line.startswith("#")]
+    assert series
+    assert all(f'process="{metrics.PROCESS_ID}"' in line for line in series)
+
+def test_events_stay_out_of_the_span_window():
+    registry = metrics.MetricsRegistry()
+    try:
+        with registry.span("openai_images"):
+            raise RuntimeError("failed")
+    except RuntimeError:
+        pass
+    for _ in range(10):
+        registry.count("llm_cache_hit")
+    snapshot = registry.snapshot()
+    assert snapshot['recent'] == {"openai_images": {'count': 1, 'errors': 1}}
+    assert snapshot['recent_events'] == {"llm_cache_hit": 10}
+    assert snapshot['counters'] == {"llm_cache_hit": 10}
+
+def test_quantities_are_exported_as_their_own_counter():
+    registry = metrics.MetricsRegistry()
+    registry.add("image_stored_bytes", 250000)
+    registry.add("image_stored_bytes", 1000)
+    snapshot = registry.snapshot()
+    assert snapshot['counters'] == {}
+    assert metrics.merge_snapshots([snapshot, snapshot])['totals'] == {"image_stored_bytes": 502000}
+    text = metrics.prometheus_text(snapshot)
+    assert f'inclusiart_image_stored_bytes_total{{process="{metrics.PROCESS_ID}"}} 251000' in text
+    assert "image_stored_bytes" not in "".join(line for line in text.splitlines() if line.startswith("inclusiart_events_total"))
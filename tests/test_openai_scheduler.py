@@ -0,0 +1,223 @@
+import threading
+import time
+import openai
+import pytest
+from openai_scheduler import DEFAULT_LIMITS, EndpointQueue, OpenAIScheduler, TokenBucket, parse_duration
+
+class FakeRawResponse:
+    def __init__(self, value, headers=None):
+        self.value = value
+        self.headers = headers or {}
+
+    def parse(self):
+        return self.value
+
+# Just what openai.RateLimitError reads from an HTTP response
+class FakeHTTPResponse:
+    def __init__(self, status_code, headers):
+        self.status_code = status_code
+        self.headers = headers
+        self.request = None
+
+def rate_limit_error(headers):
+    return openai.RateLimitError("Rate limit reached", response=FakeHTTPResponse(429, headers), body=None)
+
+@pytest.mark.parametrize("value, seconds", [("20ms", 0.02), ("1s", 1), ("6m0s", 360), ("1h2m", 3720), ("", 0), (None, 0)])
+def test_parse_duration(value, seconds):
+    assert parse_duration(value) == pytest.approx(seconds)
+
+def test_token_bucket_refills_at_its_rate():
+    bucket = TokenBucket(requests_per_minute=60, capacity=2)
+    now = bucket.updated
+    assert bucket.try_take(now)
+    assert bucket.try_take(now)
+    assert not bucket.try_take(now)
+    assert bucket.wait_time(now) == pytest.approx(1.0)
+    assert bucket.try_take(now + 1.0)
+
+def test_paused_token_bucket_hands_out_nothing():
+    bucket = TokenBucket(requests_per_minute=600)
+    bucket.pause(5)
+    now = time.monotonic()
+    assert not bucket.try_take(now)
+    assert bucket.wait_time(now) == pytest.approx(5, abs=0.1)
+
+def test_queue_serves_sessions_round_robin():
+    queue = EndpointQueue(requests_per_minute=60, max_concurrency=1)
+    tickets = {name: object() for name in ("a1", "a2", "a3", "b1", "c1")}
+    for name in ("a1", "a2", "a3", "b1", "c1"):
+        queue.add(name[0], tickets[name])
+
+    served = []
+    while queue.waiting:
+        name = next(name for name, ticket in tickets.items() if queue.is_next(ticket))
+        served.append(name)
+        queue.pop_next()
+    assert served == ["a1", "b1", "c1", "a2", "a3"]
+
+def test_queue_position_follows_service_order():
+    queue = EndpointQueue(requests_per_minute=60, max_concurrency=1)
+    tickets = {name: object() for name in ("a1", "a2", "a3", "b1", "b2", "c1")}
+    for name in ("a1", "a2", "a3", "b1", "b2", "c1"):
+        queue.add(name[0], tickets[name])
+
+    # Service order: a1, b1, c1, a2, b2, a3
+    positions = {name: queue.position(name[0], ticket) for name, ticket in tickets.items()}
+    assert positions == {"a1": 1, "b1": 2, "c1": 3, "a2": 4, "b2": 5, "a3": 6}
+
+def test_queue_remove_drops_empty_sessions():
+    queue = EndpointQueue(requests_per_minute=60, max_concurrency=1)
+    ticket = object()
+    queue.add("a", ticket)
+    queue.remove("a", ticket)
+    assert not queue.waiting
+
+def test_eta_is_bound_by_rate_or_concurrency():
+    queue = EndpointQueue(requests_per_minute=60, max_concurrency=2)
+    queue.average_latency = 4.0
+    now = time.monotonic()
+    queue.bucket.tokens = 0
+    queue.bucket.updated = now
+    # Third in line: three tokens at one per second, or three requests of 4s over two slots
+    assert queue.eta(3, now) == pytest.approx(6.0)
+    queue.average_latency = 0.1
+    assert queue.eta(3, now) == pytest.approx(3.0)
+
+def test_partial_limits_keep_the_endpoint_defaults():
+    scheduler = OpenAIScheduler({"images": {"requests_per_minute": 15}})
+    assert scheduler.queues["images"].bucket.rate == pytest.approx(15 / 60)
+    assert scheduler.queues["images"].max_concurrency == DEFAULT_LIMITS["images"]["max_concurrency"]
+    assert scheduler.queues["chat"].max_concurrency == DEFAULT_LIMITS["chat"]["max_concurrency"]
+
+def test_retry_delay_prefers_the_server_hints():
+    scheduler = OpenAIScheduler(base_delay=1.0, max_delay=30.0)
+    assert scheduler.retry_delay(0, {"retry-after-ms": "250"}) == pytest.approx(0.25)
+    assert scheduler.retry_delay(0, {"retry-after": "2"}) == pytest.approx(2.0)
+    assert 0.5 <= scheduler.retry_delay(0, {}) <= 1.5
+    assert 15 <= scheduler.retry_delay(10, {}) <= 45
+
+def test_call_retries_rate_limited_requests_and_pauses_the_endpoint():
+    scheduler = OpenAIScheduler()
+    attempts = []
+
+    def create(**request):
+        attempts.append(request)
+        if len(attempts) < 3:
+            raise rate_limit_error({"retry-after-ms": "10"})
+        return FakeRawResponse("done")
+
+    assert scheduler.call("chat", "session", create, model="gpt-4o-mini") == "done"
+    assert len(attempts) == 3
+    assert scheduler.queues["chat"].in_flight == 0
+
+def test_call_gives_up_after_max_retries():
+    scheduler = OpenAIScheduler(max_retries=1)
+
+    def create(**request):
+        raise rate_limit_error({"retry-after-ms": "1"})
+
+    with pytest.raises(openai.RateLimitError):
+        scheduler.call("chat", "session", create)
+    assert scheduler.queues["chat"].in_flight == 0
+
+def test_call_does_not_retry_other_errors():
+    scheduler = OpenAIScheduler()
+    attempts = []
+
+    def create(**request):
+        attempts.append(request)
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        scheduler.call("chat", "session", create)
+    assert len(attempts) == 1
+    assert scheduler.queues["chat"].in_flight == 0
+
+def test_exhausted_rate_limit_headers_pause_the_endpoint():
+    scheduler = OpenAIScheduler()
+    scheduler.update_from_headers("chat", {"x-ratelimit-remaining-requests": "0", "x-ratelimit-reset-requests": "2s"})
+    bucket = scheduler.queues["chat"].bucket
+    assert bucket.wait_time(time.monotonic()) == pytest.approx(2, abs=0.1)
+
+def test_waiting_sessions_get_their_turn_in_round_robin_order():
+    scheduler = OpenAIScheduler({"chat": {"requests_per_minute": 6000, "max_concurrency": 1}})
+    scheduler.acquire("chat", "blocker")
+    served = []
+    threads = []
+    for name in ("a1", "a2", "b1"):
+        def run(name=name):
+            scheduler.acquire("chat", name[0])
+            served.append(name)
+            scheduler.release("chat", 0.01)
+        threads.append(threading.Thread(target=run))
+        threads[-1].start()
+        # Queue the requests in a known order
+        while sum(len(tickets) for tickets in scheduler.queues["chat"].waiting.values()) < len(threads):
+            time.sleep(0.001)
+
+    scheduler.release("chat", 0.01)
+    for thread in threads:
+        thread.join(timeout=5)
+    assert served == ["a1", "b1", "a2"]
+
+def test_on_wait_reports_the_queue_position():
+    scheduler = OpenAIScheduler({"chat": {"requests_per_minute": 6000, "max_concurrency": 1}})
+    scheduler.acquire("chat", "blocker")
+    reports = []
+    thread = threading.Thread(target=scheduler.acquire, args=("chat", "waiting", lambda position, eta: reports.append((position, eta))))
+    thread.start()
+    while not reports:
+        time.sleep(0.01)
+    scheduler.release("chat", 0.01)
+    thread.join(timeout=5)
+    assert reports[0][0] == 1
+    assert reports[0][1] >= 0
+
+def test_retry_delay_caps_the_server_hints():
+    scheduler = OpenAIScheduler(max_delay=30.0)
+    assert scheduler.retry_delay(0, {"retry-after": "3600"}) == 30.0
+    assert scheduler.retry_delay(0, {"retry-after-ms": "600000"}) == 30.0
+
+def test_stream_holds_its_slot_until_read():
+    scheduler = OpenAIScheduler({"chat": {"requests_per_minute": 6000, "max_concurrency": 1}})
+    stream = scheduler.call("chat", "session", lambda **request: FakeRawResponse(["a", "b"]), stream=True)
+    assert scheduler.queues["chat"].in_flight == 1
+    assert list(stream) == ["a", "b"]
+    assert scheduler.queues["chat"].in_flight == 0
+
+def test_closed_stream_releases_its_slot():
+    scheduler = OpenAIScheduler({"chat": {"requests_per_minute": 6000, "max_concurrency": 1}})
+    stream = scheduler.call("chat", "session", lambda **request: FakeRawResponse(["a", "b"]), stream=True)
+    next(iter(stream))
+    stream.close()
+    stream.close()
+    assert scheduler.queues["chat"].in_flight == 0
+
+def test_stream_failing_before_its_first_chunk_is_retried():
+    scheduler = OpenAIScheduler()
+    attempts = []
+
+    def chunks(fail):
+        if fail:
+            raise rate_limit_error({"retry-after-ms": "1"})
+        yield "a"
+
+    def create(**request):
+        attempts.append(request)
+        return FakeRawResponse(chunks(fail=len(attempts) < 2))
+
+    assert list(scheduler.call("chat", "session", create, stream=True)) == ["a"]
+    assert len(attempts) == 2
+    assert scheduler.queues["chat"].in_flight == 0
+
+def test_next_request_waits_for_the_stream():
+    scheduler = OpenAIScheduler({"chat": {"requests_per_minute": 6000, "max_concurrency": 1}})
+    stream = iter(scheduler.call("chat", "first", lambda **request: FakeRawResponse(["a", "b"]), stream=True))
+    next(stream)
+    served = threading.Event()
+    thread = threading.Thread(target=lambda: (scheduler.acquire("chat", "second"), served.set()))
+    thread.start()
+    assert not served.wait(0.3)
+    list(stream)
+    assert served.wait(5)
+    thread.join(timeout=5)
@@ -0,0 +1,70 @@
+import time
+import pytest
+from pymongo.errors import AutoReconnect
+from progress_writer import ProgressWriter
+
+# Records the bulk writes a ProgressWriter sends, failing the first ones on request
+class FakeCollection:
+    name = "inclusive_data"
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.writes = []
+
+    def bulk_write(self, operations, ordered=True):
+        if self.failures:
+            self.failures -= 1
+            raise AutoReconnect("connection reset")
+        self.writes.append(operations)
+
+def updates(operations):
+    return {operation._filter['prolific_id']: operation._doc for operation in operations}
+
+@pytest.fixture
+def make_writer():
+    # A long flush interval and batch size keep the background thread out of the way; the tests flush
+    def make(collection, **options):
+        return ProgressWriter(collection, **{'batch_size': 1000, 'flush_interval': 3600, **options})
+    return make
+
+def test_updates_of_a_participant_are_coalesced(make_writer):
+    collection = FakeCollection()
+    writer = make_writer(collection, on_insert={"completed": False})
+    writer.update("p1", {"user_prompt": "A knight"})
+    writer.update("p2", {"user_prompt": "A wizard"})
+    writer.update("p1", {"bias_example": "Gender", "user_prompt": "A brave knight"})
+    writer.flush()
+
+    assert len(collection.writes) == 1
+    assert updates(collection.writes[0]) == {
+        "p1": {"$set": {"user_prompt": "A brave knight", "bias_example": "Gender"}, "$setOnInsert": {"completed": False}},
+        "p2": {"$set": {"user_prompt": "A wizard"}, "$setOnInsert": {"completed": False}},
+    }
+    assert all(operation._upsert for operation in collection.writes[0])
+
+def test_empty_flush_writes_nothing(make_writer):
+    collection = FakeCollection()
+    make_writer(collection).flush()
+    assert collection.writes == []
+
+def test_failed_batch_is_requeued_behind_newer_values(make_writer):
+    collection = FakeCollection(failures=1)
+    writer = make_writer(collection)
+    writer.update("p1", {"user_prompt": "A knight", "rating": 3})
+    writer.flush()
+    assert collection.writes == []
+
+    writer.update("p1", {"rating": 5})
+    writer.flush()
+    assert updates(collection.writes[0]) == {"p1": {"$set": {"user_prompt": "A knight", "rating": 5}}}
+
+def test_full_batch_wakes_the_background_writer(make_writer):
+    collection = FakeCollection()
+    writer = make_writer(collection, batch_size=2)
+    writer.update("p1", {"rating": 1})
+    writer.update("p2", {"rating": 2})
+    for _ in range(100):
+        if collection.writes:
+            break
+        time.sleep(0.01)
+    assert updates(collection.writes[0]).keys() == {"p1", "p2"}
@@ -0,0 +1,32 @@
+import time
+from session_snapshot import DISPLAY_URL_TTL_SECONDS, SessionSnapshot
+
+def snapshot(generated_at):
+    return SessionSnapshot(prolific_id="p1", user_prompt="A knight", final_prompt="A knight",
+                           display_prompt_image="https://images.example/1.png", display_prompt_image_at=generated_at,
+                           image_url="https://drive.example/1")
+
+def test_recent_display_image_is_restored():
+    state = {}
+    snapshot(time.time() - 60).apply_to(state)
+    assert state['display_prompt_image'] == "https://images.example/1.png"
+    assert state['final_confirmed']
+
+def test_expired_display_image_falls_back_to_the_archived_link():
+    state = {}
+    snapshot(time.time() - DISPLAY_URL_TTL_SECONDS - 1).apply_to(state)
+    assert 'display_prompt_image' not in state
+    assert state['image_url'] == "https://drive.example/1"
+
+def test_display_image_without_a_timestamp_is_not_restored():
+    state = {}
+    snapshot(None).apply_to(state)
+    assert 'display_prompt_image' not in state
+
+def test_document_round_trip_leaves_out_image_bytes():
+    state = {'prolific_id': "p1", 'user_prompt': "A knight", 'display_test_image': b"\xff\xd8", 'display_test_image_at': 1.0}
+    document = SessionSnapshot.from_session_state(state).to_document()
+    assert 'display_test_image' not in document
+    restored = SessionSnapshot.from_document({'_id': "p1", **document})
+    assert restored.user_prompt == "A knight"
+    assert restored.display_test_image == ""